@@ -1,8 +1,9 @@
 from __future__ import annotations
-import os, backoff, openai
+import os
+import llm_util
 
-openai.api_key = os.getenv("OPENAI_API_KEY")
 MODEL = os.getenv("OPENAI_MODEL_NAME", "gpt-4o-mini")
+ABSTRACT_TOKENS = int(os.getenv("ANALYSIS_ABSTRACT_TOKENS", "1500"))   # 要約はこれを超えたら切り詰める
 
 SYSTEM = (
     "あなたは学術論文を詳細に解析して報告する日本語アシスタントです。"
@@ -22,17 +23,15 @@ PROMPT = """
 8. はハッシュタグ付き 140 字以内で。
 """
 
-@backoff.on_exception(backoff.expo, openai.OpenAIError, max_tries=5, jitter=None)
-def _chat(msgs):  # type: ignore[valid-type]
-    return openai.chat.completions.create(
-        model=MODEL, messages=msgs, temperature=0.3
-    ).choices[0].message.content.strip()
+@llm_util.retry(max_tries=5, jitter=None)
+def _chat(msgs):
+    return llm_util.chat("analysis", msgs, model=MODEL, temperature=0.3)
 
 def generate_analysis(title: str, abstract: str) -> tuple[str, str]:
     md = _chat([
         {"role":"system","content":SYSTEM},
         {"role":"system","content":PROMPT},
-        {"role":"user","content":f"タイトル: {title}\n\n要約: {abstract}"}
+        {"role":"user","content":f"タイトル: {title}\n\n要約: {llm_util.truncate(abstract, ABSTRACT_TOKENS, MODEL)}"}
     ])
     tweet = md.splitlines()[-1].strip()
     if len(tweet) > 140: tweet = tweet[:137] + "…"
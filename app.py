@@ -1,267 +1,946 @@
 from __future__ import annotations
-import os, sqlite3, arxiv, markdown, feedparser, requests, backoff
-from contextlib import closing
-from datetime import datetime, timezone
-from bs4 import BeautifulSoup
-from flask import Flask, render_template, request, jsonify, redirect, url_for
-
-from feeds import FEEDS
-from translate_util import translate_text_openai
+import os, re, json, time, random, sqlite3, threading, hashlib, functools, difflib, unicodedata, markdown
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta, timezone
+from typing import TYPE_CHECKING
+from flask import (Flask, render_template, request, jsonify, redirect, url_for, make_response, g,
+                   has_app_context, Response, stream_with_context)
+from markupsafe import escape
+
+from feeds import FEEDS, SCRAPERS
+from translate_util import translate_text_openai, translate_many, prune_cache, CACHE_STATS
 from analysis_util  import generate_analysis
+# arxiv / feedparser / requests / numpy (related_util) / bs4 (scrape_util) / openai は
+# 使う関数の中で import する。Web ワーカーと cron の起動を軽くするため
+import llm_util, metrics_util, scrape_util, archive_util
+from bulk_util import BulkWriter, existing_keys
+
+if TYPE_CHECKING:
+    import requests
 
-DB_PATH = "neurascope.db"
+DB_PATH = os.getenv("NEURASCOPE_DB", "neurascope.db")
 UA      = {"User-Agent": "Mozilla/5.0 (NeuraScope)"}
 
 app = Flask(__name__)
 app.config["JSON_SORT_KEYS"] = False
 
 # ───────────────────────── DB
-def get_db():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
+# 接続ごとに設定する PRAGMA（journal_mode=WAL は DB ファイルに永続化されるので初回のみ）
+PRAGMAS = {
+    "synchronous": "NORMAL",       # WAL では NORMAL でも破損しない
+    "cache_size": "-32000",        # 約 32MB
+    "mmap_size": str(256 << 20),
+    "temp_store": "MEMORY",
+    "busy_timeout": "10000",
+}
+
+_local = threading.local()
+_schema_lock = threading.Lock()
+_schema_ready = False
+
+class _TimedConnection(sqlite3.Connection):
+    """execute 系の所要時間を文の種類 (SELECT/INSERT/...) ごとに記録する接続"""
+
+    def _timed(self, method, sql, *args):
+        t0 = time.perf_counter()
+        try:
+            return method(self, sql, *args)
+        finally:
+            op = sql.lstrip().split(None, 1)[0].upper() if sql.strip() else "?"
+            metrics_util.SQL_SECONDS.observe(time.perf_counter() - t0, op=op)
+
+    def execute(self, sql, *args):
+        return self._timed(sqlite3.Connection.execute, sql, *args)
+
+    def executemany(self, sql, *args):
+        return self._timed(sqlite3.Connection.executemany, sql, *args)
+
+def _connect() -> sqlite3.Connection:
+    conn = sqlite3.connect(DB_PATH, timeout=10, cached_statements=256, check_same_thread=False,
+                           factory=_TimedConnection)
+    archive_util.register(conn)   # 圧縮列の展開 (row_factory と SQL の unz())
+    for k, v in PRAGMAS.items():
+        conn.execute(f"PRAGMA {k}={v}")
     return conn
 
-def init_db():
-    with closing(get_db()) as conn, open("schema.sql", encoding="utf-8") as f:
-        conn.executescript(f.read())
+def get_db() -> sqlite3.Connection:
+    """スレッドごとに使い回す接続を返す。リクエスト中は g に載せて共有する。
+
+    呼び出し側は close せず、`with get_db() as conn:` でトランザクション境界だけを作る。
+    """
+    if has_app_context() and "db" in g:
+        return g.db
+    conn = getattr(_local, "conn", None)
+    if conn is None or _local.path != DB_PATH:
+        conn = _local.conn = _connect()
+        _local.path = DB_PATH
+        _ensure_schema(conn)
+    if has_app_context():
+        g.db = conn
+    return conn
+
+@app.teardown_appcontext
+def _release_db(exc):
+    conn = g.pop("db", None)
+    if conn is not None and conn.in_transaction:
+        conn.rollback()
+
+# 既存 DB に後から足した列 (table, column, 型)
+MIGRATIONS = [
+    ("papers",     "analysis_html", "TEXT"),
+    ("papers",     "html_ver",      "TEXT"),
+    ("qa",         "answer_html",   "TEXT"),
+    ("qa",         "html_ver",      "TEXT"),
+    ("article_qa", "answer_html",   "TEXT"),
+    ("article_qa", "html_ver",      "TEXT"),
+    ("papers",     "enrich_status",   "TEXT DEFAULT 'done'"),
+    ("papers",     "enrich_attempts", "INTEGER DEFAULT 0"),
+    ("papers",     "enrich_error",    "TEXT"),
+    ("papers",     "lease_until",     "TEXT"),
+    ("articles",   "enrich_status",   "TEXT DEFAULT 'done'"),
+    ("articles",   "enrich_attempts", "INTEGER DEFAULT 0"),
+    ("articles",   "enrich_error",    "TEXT"),
+    ("articles",   "lease_until",     "TEXT"),
+    ("feed_state", "poll_interval",   "REAL"),
+    ("feed_state", "last_poll_at",    "INTEGER"),
+    ("feed_state", "next_poll_at",    "INTEGER"),
+    ("feed_state", "failures",        "INTEGER DEFAULT 0"),
+    # 並べ替え・日付グループ用の整数列。VIRTUAL なので追加時に既存行を書き換えない
+    ("papers",     "created_ts",  "INTEGER GENERATED ALWAYS AS (unixepoch(created_at)) VIRTUAL"),
+    ("papers",     "created_day", "INTEGER GENERATED ALWAYS AS (unixepoch(created_at) / 86400) VIRTUAL"),
+    ("articles",   "created_ts",  "INTEGER GENERATED ALWAYS AS (unixepoch(created_at)) VIRTUAL"),
+    ("articles",   "created_day", "INTEGER GENERATED ALWAYS AS (unixepoch(created_at) / 86400) VIRTUAL"),
+]
+
+# マイグレーションで足した列に張る索引
+POST_MIGRATION = [
+    "CREATE INDEX IF NOT EXISTS idx_papers_enrich   ON papers(enrich_status, id)",
+    "CREATE INDEX IF NOT EXISTS idx_articles_enrich ON articles(enrich_status, id)",
+    # 一覧は created_ts の降順。索引は昇順のまま逆向きに読むので、暗黙の rowid まで含めて
+    # ORDER BY created_ts DESC, id DESC を一時 B-tree なしで返せる
+    "CREATE INDEX IF NOT EXISTS idx_papers_ts        ON papers(created_ts, id)",
+    "CREATE INDEX IF NOT EXISTS idx_papers_fav_ts    ON papers(favorite, created_ts)",
+    "CREATE INDEX IF NOT EXISTS idx_articles_ts      ON articles(created_ts, id)",
+    "CREATE INDEX IF NOT EXISTS idx_articles_cat_ts  ON articles(category, created_ts)",
+    "CREATE INDEX IF NOT EXISTS idx_articles_fav_ts  ON articles(favorite, category, created_ts)",
+    "CREATE INDEX IF NOT EXISTS idx_qa_paper         ON qa(paper_id, created_at)",
+    "CREATE INDEX IF NOT EXISTS idx_article_qa_article ON article_qa(article_id, created_at)",
+    # 上の複合索引の先頭列と重なる単独索引
+    "DROP INDEX IF EXISTS idx_papers_created",
+    "DROP INDEX IF EXISTS idx_articles_cat_created",
+    "DROP INDEX IF EXISTS idx_papers_fav",
+    "DROP INDEX IF EXISTS idx_articles_cat",
+    "DROP INDEX IF EXISTS idx_articles_fav",
+]
+
+# 圧縮列に対応する前の FTS (content が元テーブル) は作り直す
+_OLD_FTS = ["papers_fts_ai", "papers_fts_ad", "papers_fts_au", "articles_fts_ai", "articles_fts_ad", "articles_fts_au"]
+
+def init_db(conn: sqlite3.Connection | None = None):
+    conn = conn or get_db()
+    fts = conn.execute("SELECT sql FROM sqlite_master WHERE name='papers_fts'").fetchone()
+    if fts and "papers_text" not in fts[0]:
+        for trigger in _OLD_FTS:
+            conn.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+        conn.execute("DROP TABLE papers_fts")
+        conn.execute("DROP TABLE IF EXISTS articles_fts")
         conn.commit()
+        fts = None
+    # unz() を呼ぶ旧トリガーはアプリ外からの書き込みを失敗させるので schema.sql の版に置き換える
+    for (trigger,) in conn.execute(
+        f"SELECT name FROM sqlite_master WHERE type='trigger' AND sql LIKE '%unz(%' AND name IN ({','.join('?' * len(_OLD_FTS))})",
+        _OLD_FTS,
+    ).fetchall():
+        conn.execute(f"DROP TRIGGER {trigger}")
+    has_fts = fts is not None
+    with open(os.path.join(os.path.dirname(__file__), "schema.sql"), encoding="utf-8") as f:
+        conn.executescript(f.read())
+    if not has_fts:
+        # 既存 DB に FTS を追加した直後は既存行を索引に載せる
+        conn.execute("INSERT INTO papers_fts(papers_fts) VALUES('rebuild')")
+        conn.execute("INSERT INTO articles_fts(articles_fts) VALUES('rebuild')")
+    conn.execute("PRAGMA journal_mode=WAL")
+    for table, col, decl in MIGRATIONS:
+        cols = {r["name"] for r in conn.execute(f"PRAGMA table_xinfo({table})")}
+        if col not in cols:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN {col} {decl}")
+    for sql in POST_MIGRATION:
+        conn.execute(sql)
+    conn.commit()
+
+def _ensure_schema(conn: sqlite3.Connection):
+    """プロセス内で最初の接続時に一度だけスキーマを適用する"""
+    global _schema_ready
+    if _schema_ready:
+        return
+    with _schema_lock:
+        if not _schema_ready:
+            init_db(conn)
+            _schema_ready = True
+
+# ───────────────────────── Markdown
+MD_EXT = ["fenced_code", "tables", "toc"]
+# 拡張や markdown のバージョンが変わると保存済み HTML は無効になる
+HTML_VER = hashlib.sha1(f"{markdown.__version__}|{','.join(MD_EXT)}".encode()).hexdigest()[:12]
+
+def render_md(md: str | None) -> str:
+    return markdown.markdown(md or "", extensions=MD_EXT)
+
+def stored_html(row, md_col: str, html_col: str) -> str:
+    """保存済み HTML が現行バージョンならそれを、古ければその場で描画して返す"""
+    if row[html_col] is not None and row["html_ver"] == HTML_VER:
+        return row[html_col]
+    return render_md(row[md_col])
+
+def backfill_html(chunk: int = 500):
+    """analysis_html / answer_html が未生成または旧バージョンの行を描画し直す"""
+    print("[html] backfill start")
+    targets = [
+        ("papers", "analysis_ja", "analysis_html"),
+        ("qa", "answer_md", "answer_html"),
+        ("article_qa", "answer_md", "answer_html"),
+    ]
+    with get_db() as conn:
+        for table, md_col, html_col in targets:
+            # 圧縮済み (コールド) の行は描き直した HTML も圧縮して書き戻す
+            packed = html_col in archive_util.COLUMNS.get(table, ())
+            cold = f"typeof({html_col})='blob' OR typeof({md_col})='blob'" if packed else "0"
+            rows = conn.execute(
+                f"SELECT id,{md_col},{cold} AS cold FROM {table} WHERE html_ver IS NULL OR html_ver<>?", (HTML_VER,)
+            ).fetchall()
+            for i in range(0, len(rows), chunk):
+                updates = []
+                for r in rows[i : i + chunk]:
+                    html = render_md(r[md_col])
+                    updates.append((archive_util.pack(html) if r["cold"] else html, HTML_VER, r["id"]))
+                conn.executemany(f"UPDATE {table} SET {html_col}=?, html_ver=? WHERE id=?", updates)
+                conn.commit()
+            print(f"  {table}: {len(rows)}")
+    print("[html] backfill end")
+
+def _report_translation_cache():
+    pruned = prune_cache()
+    print(f"  translation cache: hit={CACHE_STATS['hit']} miss={CACHE_STATS['miss']} pruned={pruned}")
 
 # ───────────────────────── arXiv 取得
-def fetch_arxiv():
-    print("[arxiv] start")
-    with closing(get_db()) as conn:
-        cur = conn.cursor()
+ARXIV_WORKERS = int(os.getenv("ARXIV_WORKERS", "4"))   # 同時に LLM へ投げる論文数
+ARXIV_CATEGORIES = os.getenv("ARXIV_CATEGORIES", "cs.AI,cs.LG").split(",")
+ARXIV_INITIAL = int(os.getenv("ARXIV_INITIAL", "20"))           # ウォーターマークが無い初回に取る件数
+ARXIV_MAX_RESULTS = int(os.getenv("ARXIV_MAX_RESULTS", "2000"))  # 1 回の検索で遡る件数 (超えたら日付範囲で続きを検索)
+ARXIV_PAGE_SIZE_API = 100                                        # arXiv API の 1 ページの件数
+
+PAPER_COLUMNS = [
+    "arxiv_id", "title_en", "abstract_en", "authors", "categories", "comment",
+    "published_at", "pdf_url", "favorite", "created_at", "enrich_status",
+]
+
+def _raw_paper(r) -> dict:
+    """翻訳前の論文 1 行。翻訳・解析はエンリッチワーカーが後で埋める"""
+    return {
+        "arxiv_id": r.get_short_id(),
+        "title_en": r.title.strip(),
+        "abstract_en": r.summary.strip(),
+        "authors": ", ".join(a.name for a in r.authors),
+        "categories": " ".join(r.categories),
+        "comment": (r.comment or "").strip(),
+        "published_at": r.published.isoformat(timespec="seconds"),
+        "pdf_url": next((l.href for l in r.links if l.title == "pdf"), None),
+        "favorite": 0,
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "enrich_status": "pending",
+    }
+
+def _arxiv_query(categories: list[str]) -> str:
+    return " OR ".join(f"cat:{c.strip()}" for c in categories if c.strip())
+
+def _new_arxiv_results(conn, query: str, mark: datetime | None) -> tuple[list, list[datetime], bool]:
+    """新しい順にページングし、ウォーターマークより古くなったら打ち切る。
+
+    1 回の検索は ARXIV_MAX_RESULTS 件までなので、マークに届く前に上限に達したら
+    submittedDate を (マーク〜見た中で最も古い時刻) に絞った検索で続きを遡る。
+    既知かどうかはページ単位の IN 句 1 回で判定する。
+    戻り値は (未登録の結果, 見た結果の published, マークまで遡れたか)。
+    """
+    import arxiv
+
+    client = arxiv.Client(page_size=ARXIV_PAGE_SIZE_API)
+    new, seen, page, ids = [], [], [], set()
+
+    def flush():
+        if not page:
+            return
+        known = existing_keys(conn, "papers", "arxiv_id", [r.get_short_id() for r in page])
+        new.extend(r for r in page if r.get_short_id() not in known)
+        page.clear()
+
+    window, prev_oldest = query, None
+    while True:
         search = arxiv.Search(
-            "cat:cs.AI OR cat:cs.LG",
+            window,
             sort_by=arxiv.SortCriterion.SubmittedDate,
-            max_results=20,
+            max_results=ARXIV_MAX_RESULTS if mark else ARXIV_INITIAL,
         )
-        for r in search.results():                                     # type:ignore[attr-defined]
-            aid = r.get_short_id()
-            if cur.execute("SELECT 1 FROM papers WHERE arxiv_id=?", (aid,)).fetchone():
+        count, oldest, reached = 0, None, False
+        for r in client.results(search):
+            # 同一時刻の取りこぼしを避けるため境界 (==) は既知判定に任せる
+            if mark and r.published < mark:
+                reached = True
+                break
+            count += 1
+            oldest = r.published
+            if r.get_short_id() in ids:   # 前の検索窓と重なる分
                 continue
-            title_en = r.title.strip()
-            abstract_en = r.summary.strip()
-            title_ja = translate_text_openai(title_en)
-            abstract_ja = translate_text_openai(abstract_en)
-            analysis_ja, tweet_ja = generate_analysis(title_ja, abstract_ja)
-            now = datetime.now(timezone.utc).isoformat(timespec="seconds")
-            cur.execute(
-                """INSERT INTO papers
-                  (arxiv_id,title_en,title_ja,abstract_en,abstract_ja,
-                   authors,categories,comment,published_at,
-                   analysis_ja,tweet_ja,pdf_url,
-                   favorite,created_at,translated_at)
-                  VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)""",
-                (
-                    aid,
-                    title_en,
-                    title_ja,
-                    abstract_en,
-                    abstract_ja,
-                    ", ".join(a.name for a in r.authors),
-                    " ".join(r.categories),
-                    (r.comment or "").strip(),
-                    r.published.isoformat(timespec="seconds"),
-                    analysis_ja,
-                    tweet_ja,
-                    next((l.href for l in r.links if l.title == "pdf"), None),
-                    0,
-                    now,
-                    now,
-                ),
+            ids.add(r.get_short_id())
+            seen.append(r.published)
+            page.append(r)
+            if len(page) >= ARXIV_PAGE_SIZE_API:
+                flush()
+        flush()
+        if not mark or reached or count < ARXIV_MAX_RESULTS:
+            return new, seen, True
+        if oldest == prev_oldest:
+            # 同じ分に上限を超える件数があり、範囲を狭めても先へ進めない
+            return new, seen, False
+        prev_oldest = oldest
+        window = f"({query}) AND submittedDate:[{mark:%Y%m%d%H%M} TO {oldest:%Y%m%d%H%M}]"
+
+def fetch_arxiv(workers: int = ARXIV_WORKERS, categories: list[str] | None = None, enrich: bool = True):
+    print("[arxiv] start")
+    t0 = time.perf_counter()
+    query = _arxiv_query(categories or ARXIV_CATEGORIES)
+    with get_db() as conn:
+        row = conn.execute("SELECT last_published FROM ingest_state WHERE query=?", (query,)).fetchone()
+        mark = datetime.fromisoformat(row[0]) if row and row[0] else None
+        t1 = time.perf_counter()
+        try:
+            new, seen, complete = _new_arxiv_results(conn, query, mark)
+        except Exception:
+            metrics_util.OUTBOUND_SECONDS.observe(time.perf_counter() - t1, source="arxiv", status="error")
+            raise
+        metrics_util.OUTBOUND_SECONDS.observe(time.perf_counter() - t1, source="arxiv", status=200)
+    print(f"  {query}: since {mark.isoformat() if mark else '-'} seen={len(seen)} new={len(new)}")
+
+    # 英語のまま即座に保存し、翻訳・解析はエンリッチキューに回す
+    writer = BulkWriter("papers", PAPER_COLUMNS, key="arxiv_id")
+    for r in new:
+        writer.add(_raw_paper(r))
+    with get_db() as conn:
+        counts = writer.flush(conn)
+        if seen:
+            if complete:
+                last = max(seen + ([mark] if mark else []))
+            else:
+                # マークまで遡れなかったときは進めない (間の論文を読み飛ばさない)
+                last = mark
+                print(f"    ⚠️ {query}: stopped before reaching {mark.isoformat()}, watermark not advanced")
+            conn.execute(
+                """INSERT OR REPLACE INTO ingest_state (query,last_published,updated_at)
+                   VALUES (?,?,CURRENT_TIMESTAMP)""",
+                (query, last.isoformat(timespec="seconds")),
             )
+        _record_runs(conn, [("arxiv", query, counts["new"], time.perf_counter() - t0, 1)])
         conn.commit()
+    if counts["new"] or counts["updated"]:
+        bump_data_version()
+    # 関連論文索引への追加は解析が入ってから (enrich_pending の最後) 行う
+    print(f"    +{counts['new']} ~{counts['updated']} skipped={counts['skipped']}")
+    if enrich:
+        enrich_pending(workers)
     print("[arxiv] end")
 
+def related_index_path() -> str:
+    """関連論文ベクトル索引のファイル名 (拡張子なし)"""
+    return DB_PATH + ".related"
+
+def build_related() -> int:
+    """関連論文索引を作り直す。詳細ページの関連欄が変わるのでデータ版数も上げる"""
+    import related_util
+
+    n = related_util.rebuild(related_index_path(), get_db())
+    bump_data_version()
+    return n
+
 # ───────────────────────── 外部フィード取得
-def fetch_feeds():
+FEED_WORKERS = int(os.getenv("FEED_WORKERS", "8"))    # 同時に取得するソース数
+ARTICLE_COLUMNS = [
+    "title_en", "link", "summary_en", "published", "source_id", "category", "favorite", "enrich_status",
+]
+
+def fetch_feeds(workers: int = FEED_WORKERS, enrich: bool = True, sources: list[str] | None = None):
+    """sources を指定するとそのソースだけを取得する (既定は FEEDS の全ソース)"""
     print("[feeds] start")
-    with closing(get_db()) as conn:
-        cur = conn.cursor()
-        for sid, meta in FEEDS.items():
-            print("  ─", meta["name"])
-            try:
-                entries = _get_entries(meta)
-            except Exception as e:
-                print("    ⚠️ skip:", e)
-                continue
-            added = 0
-            for e in entries:
-                title_en = e["title"].strip()
-                link = e["link"].split("?")[0]
-                if not title_en or not link:
-                    continue
-                if cur.execute("SELECT 1 FROM articles WHERE link=?", (link,)).fetchone():
-                    continue
-                summary_en = e.get("summary", "").strip()
-                pub = e.get("published", "")[:25]
-                title_ja = translate_text_openai(title_en)
-                summary_ja = translate_text_openai(summary_en) if summary_en else None
-                cur.execute(
-                    """INSERT INTO articles
-                      (title_en,title_ja,link,summary_en,summary_ja,
-                       published,source_id,category,favorite)
-                      VALUES (?,?,?,?,?,?,?,? ,0)""",
-                    (
-                        title_en,
-                        title_ja,
-                        link,
-                        summary_en,
-                        summary_ja,
-                        pub,
-                        sid,
-                        meta["category"],
-                    ),
-                )
-                added += 1
-            print(f"    +{added}")
-        conn.commit()
-    print("[feeds] end")
+    t0 = time.perf_counter()
+    targets = {sid: FEEDS[sid] for sid in sources if sid in FEEDS} if sources is not None else FEEDS
+    with get_db() as conn:
+        state = {r["source_id"]: dict(r) for r in conn.execute("SELECT * FROM feed_state")}
 
-def _get_entries(meta: dict):
-    kind = meta.get("scrape")
-    if kind == "gh":
-        return _scrape_github()
-    if kind == "hf":
-        return _scrape_hf()
-    if kind == "pwc":
-        return _scrape_pwc()
-    if kind == "batch":
-        return _scrape_batch()
-    r = requests.get(meta["url"], headers=UA, timeout=20)
-    r.raise_for_status()
-    return feedparser.parse(r.content).entries
-
-def _scrape_github():
-    htmltxt = requests.get("https://github.com/trending?since=daily", headers=UA, timeout=20).text
-    soup = BeautifulSoup(htmltxt, "html.parser")
-    results = []
-    for row in soup.select("article.Box-row"):
-        a_tag = row.select_one("h3 > a, h2 > a")
-        if not a_tag:
+    # ネットワーク取得とパースは全ソース並列、重複判定はソース順に行う
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futs = {sid: pool.submit(_timed_entries, sid, meta, state.get(sid, {})) for sid, meta in targets.items()}
+
+    # 全ソース分を溜めて最後にまとめて書き込み、書き込みロックを握る時間を短くする
+    writer, validated, runs = BulkWriter("articles", ARTICLE_COLUMNS, key="link"), [], []
+    polled = {}     # source_id -> (新着数, 取得件数 or None(304), 成功か)
+    conn = get_db()
+    for sid, meta in targets.items():
+        print("  ─", meta["name"])
+        try:
+            entries, validators, secs = futs[sid].result()
+        except Exception as e:
+            print("    ⚠️ skip:", e)
+            runs.append(("feeds", sid, 0, None, 0))
+            polled[sid] = (0, None, False)
             continue
-        desc_tag = row.select_one("p")
-        results.append(
-            {
-                "title": a_tag.get_text(" ", strip=True),
-                "link": "https://github.com" + a_tag["href"],
-                "summary": desc_tag.get_text(strip=True) if desc_tag else "",
-            }
-        )
-    return results
-
-def _scrape_hf():
-    htmltxt = requests.get("https://huggingface.co/papers", headers=UA, timeout=20).text
-    soup = BeautifulSoup(htmltxt, "html.parser")
-    for li in soup.select("li.paper-item"):
-        h = li.select_one("h4") or li.select_one("h3")
-        a = li.select_one("a[href*='/papers/']")
-        if not h or not a:
+        if entries is None:
+            print("    304 not modified")
+            runs.append(("feeds", sid, 0, secs, 1))
+            polled[sid] = (0, None, True)
             continue
-        p = li.select_one("p")
-        yield {
-            "title": h.get_text(strip=True),
-            "link": "https://huggingface.co" + a["href"],
-            "summary": p.get_text(strip=True) if p else "",
-        }
+        fresh = {}
+        for e in entries:
+            title_en = e["title"].strip()
+            link = normalize_link(e["link"])
+            if title_en and link and link not in fresh:
+                fresh[link] = (title_en, e.get("summary", "").strip(), e.get("published", "")[:25])
+        known = existing_keys(conn, "articles", "link", fresh)
+        fresh = [(link, *v) for link, v in fresh.items() if link not in known and link not in writer.rows]
+        # 翻訳はエンリッチキューに回し、ここでは英語のまま保存する
+        for link, title_en, summary_en, pub in fresh:
+            writer.add({
+                "title_en": title_en,
+                "link": link,
+                "summary_en": summary_en,
+                "published": pub,
+                "source_id": sid,
+                "category": meta["category"],
+                "favorite": 0,
+                "enrich_status": "pending",
+            })
+        validated.append((sid, validators["etag"], validators["last_modified"]))
+        runs.append(("feeds", sid, len(fresh), secs, 1))
+        polled[sid] = (len(fresh), len(entries), True)
+        print(f"    +{len(fresh)} candidates")
 
-def _scrape_pwc():
-    htmltxt = requests.get("https://paperswithcode.com/trending", headers=UA, timeout=20).text
-    soup = BeautifulSoup(htmltxt, "html.parser")
-    for card in soup.select("div.paper-card"):
-        h = card.select_one("h1 a")
-        abs_p = card.select_one("p[itemprop='description']")
-        if not h:
-            continue
-        yield {
-            "title": h.get_text(strip=True),
-            "link": "https://paperswithcode.com" + h["href"],
-            "summary": abs_p.get_text(strip=True) if abs_p else "",
-        }
+    with conn:
+        counts = writer.flush(conn)
+        # バリデータは記事を書き終えてから保存する (途中で落ちたら次回取り直す)
+        conn.executemany(
+            """INSERT INTO feed_state (source_id,etag,last_modified,checked_at)
+               VALUES (?,?,?,CURRENT_TIMESTAMP)
+               ON CONFLICT(source_id) DO UPDATE SET
+                 etag=excluded.etag, last_modified=excluded.last_modified, checked_at=excluded.checked_at""",
+            validated,
+        )
+        _reschedule(conn, state, polled)
+        _record_runs(conn, runs + [("feeds", "_total", counts["new"], time.perf_counter() - t0, 1)])
+    if counts["new"] or counts["updated"]:
+        bump_data_version()
+    print(f"  articles: +{counts['new']} ~{counts['updated']} skipped={counts['skipped']}")
+    if enrich:
+        enrich_pending()
+    print("[feeds] end")
 
-def _scrape_batch():
-    htmltxt = requests.get("https://www.deeplearning.ai/the-batch/", headers=UA, timeout=20).text
-    soup = BeautifulSoup(htmltxt, "html.parser")
-    for art in soup.select("article.post-preview, div.post-block"):
-        h = art.select_one("h3") or art.select_one("h2")
-        a = art.select_one("a[href]")
-        if not h or not a:
-            continue
-        p = art.select_one("div.excerpt") or art.select_one("p")
-        yield {
-            "title": h.get_text(strip=True),
-            "link": a["href"],
-            "summary": p.get_text(strip=True) if p else "",
-        }
+# ───────────────────────── フィードの適応ポーリング
+# ソースごとに poll_interval を持ち、1 回の取得で新着が FEED_TARGET_NEW 件程度になるよう
+# 観測した新着ペースから間隔を決める。新着なし (304 含む) は 1.5 倍、エラーは 2 倍に延ばす。
+FEED_MIN_INTERVAL = int(os.getenv("FEED_MIN_INTERVAL", "300"))
+FEED_MAX_INTERVAL = int(os.getenv("FEED_MAX_INTERVAL", "86400"))
+FEED_INITIAL_INTERVAL = int(os.getenv("FEED_INITIAL_INTERVAL", "3600"))
+FEED_TARGET_NEW = float(os.getenv("FEED_TARGET_NEW", "5"))
+FEED_JITTER = float(os.getenv("FEED_JITTER", "0.1"))          # 次回時刻を ±10% ずらす
+FEED_TICK_SEC = int(os.getenv("FEED_TICK_SEC", "60"))          # 期限が来たソースを調べる間隔
 
-# ───────────────────────── UI Helpers
-MD_EXT = ["fenced_code", "tables", "toc"]
+def next_interval(interval: float, elapsed: float | None, new: int, fetched: int | None, ok: bool) -> float:
+    """前回の間隔と今回の結果から次の間隔 (秒) を決める"""
+    if not ok:
+        interval *= 2
+    elif not new:
+        interval *= 1.5
+    elif fetched and new >= fetched:
+        interval /= 2       # 全件が新着 = 取りこぼしている可能性があるので一気に詰める
+    elif elapsed:
+        interval = (interval + elapsed * FEED_TARGET_NEW / new) / 2
+    return min(max(interval, FEED_MIN_INTERVAL), FEED_MAX_INTERVAL)
 
-def group_arxiv(fav: bool = False):
-    where = "WHERE favorite=1" if fav else ""
-    with closing(get_db()) as conn:
-        rows = conn.execute(
-            f"""
-          SELECT id,title_ja,favorite,analysis_ja,pdf_url,
-                 substr(created_at,1,10) AS cdate
-            FROM papers {where}
-        ORDER BY created_at DESC"""
+def _reschedule(conn, state: dict, polled: dict):
+    now = time.time()
+    rows = []
+    for sid, (new, fetched, ok) in polled.items():
+        prev = state.get(sid, {})
+        last = prev.get("last_poll_at")
+        interval = next_interval(
+            prev.get("poll_interval") or FEED_INITIAL_INTERVAL, now - last if last else None, new, fetched, ok
+        )
+        failures = 0 if ok else (prev.get("failures") or 0) + 1
+        due = now + interval * random.uniform(1 - FEED_JITTER, 1 + FEED_JITTER)
+        rows.append((sid, interval, int(now), int(due), failures))
+    conn.executemany(
+        """INSERT INTO feed_state (source_id,poll_interval,last_poll_at,next_poll_at,failures)
+           VALUES (?,?,?,?,?)
+           ON CONFLICT(source_id) DO UPDATE SET
+             poll_interval=excluded.poll_interval, last_poll_at=excluded.last_poll_at,
+             next_poll_at=excluded.next_poll_at, failures=excluded.failures""",
+        rows,
+    )
+
+def poll_due_feeds(workers: int = FEED_WORKERS, enrich: bool = False) -> list[str]:
+    """next_poll_at を過ぎた (または未登録の) ソースだけを取得し、取得したソースを返す"""
+    with get_db() as conn:
+        due_at = {r[0]: r[1] for r in conn.execute("SELECT source_id, next_poll_at FROM feed_state")}
+    now = time.time()
+    due = [sid for sid in FEEDS if (due_at.get(sid) or 0) <= now]
+    if due:
+        fetch_feeds(workers, enrich, sources=due)
+    return due
+
+def _timed_entries(sid: str, meta: dict, validators: dict) -> tuple[list | None, dict, float]:
+    t0 = time.perf_counter()
+    entries, validators = _get_entries(sid, meta, validators)
+    return entries, validators, time.perf_counter() - t0
+
+def _record_runs(conn, runs: list[tuple]):
+    """(job, source, items, seconds, ok) を ingest_runs に上書き保存する (/metrics が読む)"""
+    conn.executemany(
+        """INSERT OR REPLACE INTO ingest_runs (job,source,items,seconds,ok,finished_at)
+           VALUES (?,?,?,?,?,strftime('%s','now'))""",
+        runs,
+    )
+
+def normalize_link(link: str) -> str:
+    """クエリ文字列 (utm_* など) を落として重複判定のキーにする"""
+    return (link or "").split("?")[0]
+
+_session: requests.Session | None = None
+
+def _http() -> requests.Session:
+    """全ソースで共有するコネクションプール付きセッション"""
+    global _session
+    if _session is None:
+        import requests
+
+        s = requests.Session()
+        s.headers.update(UA)
+        adapter = requests.adapters.HTTPAdapter(pool_connections=16, pool_maxsize=max(FEED_WORKERS, 10))
+        s.mount("https://", adapter)
+        s.mount("http://", adapter)
+        _session = s
+    return _session
+
+def _get_entries(sid: str, meta: dict, validators: dict) -> tuple[list | None, dict]:
+    """条件付き GET でソースを取得する。304 の場合は (None, validators) を返す"""
+    import requests, feedparser
+
+    headers = {}
+    if validators.get("etag"):
+        headers["If-None-Match"] = validators["etag"]
+    if validators.get("last_modified"):
+        headers["If-Modified-Since"] = validators["last_modified"]
+    t0 = time.perf_counter()
+    try:
+        r = _http().get(meta["url"], headers=headers, timeout=20)
+    except requests.RequestException:
+        metrics_util.OUTBOUND_SECONDS.observe(time.perf_counter() - t0, source=sid, status="error")
+        raise
+    metrics_util.OUTBOUND_SECONDS.observe(time.perf_counter() - t0, source=sid, status=r.status_code)
+    if r.status_code == 304:
+        return None, validators
+    r.raise_for_status()
+    validators = {"etag": r.headers.get("ETag"), "last_modified": r.headers.get("Last-Modified")}
+    kind = meta.get("scrape")
+    if kind:
+        with metrics_util.SCRAPE_SECONDS.time(scraper=kind):
+            return scrape_util.scrape(SCRAPERS[kind], r.text), validators
+    with metrics_util.SCRAPE_SECONDS.time(scraper="feedparser"):
+        return feedparser.parse(r.content).entries, validators
+
+# ───────────────────────── エンリッチ (翻訳・解析) キュー
+# 取り込みは英語のまま enrich_status='pending' で保存し、ここで翻訳・解析を埋める。
+# 行の取得は lease_until 付きで「借りる」ので、複数ワーカーや途中で落ちたワーカーがいても
+# リースが切れた行は別のワーカーが拾い直す。
+ENRICH_BATCH = int(os.getenv("ENRICH_BATCH", "20"))                 # 1 回に借りる論文数 (記事は 5 倍)
+ENRICH_LEASE_SEC = int(os.getenv("ENRICH_LEASE_SEC", "900"))
+ENRICH_MAX_ATTEMPTS = int(os.getenv("ENRICH_MAX_ATTEMPTS", "3"))
+ENRICH_INTERVAL_SEC = int(os.getenv("ENRICH_INTERVAL_SEC", "60"))   # --worker の実行間隔
+
+def _iso(dt: datetime) -> str:
+    return dt.astimezone(timezone.utc).isoformat(timespec="seconds")
+
+def _claim(table: str, cols: str, limit: int) -> list[sqlite3.Row]:
+    """pending またはリース切れの行を running にして返す"""
+    now = datetime.now(timezone.utc)
+    with get_db() as conn:
+        # 試行回数を使い切ったままリースが切れた行は failed にする
+        conn.execute(
+            f"""UPDATE {table} SET enrich_status='failed', lease_until=NULL
+                 WHERE enrich_status='running' AND lease_until<? AND enrich_attempts>=?""",
+            (_iso(now), ENRICH_MAX_ATTEMPTS),
+        )
+        return conn.execute(
+            f"""UPDATE {table}
+                   SET enrich_status='running', lease_until=?, enrich_attempts=enrich_attempts+1
+                 WHERE id IN (SELECT id FROM {table}
+                               WHERE enrich_status='pending'
+                                  OR (enrich_status='running' AND lease_until<?)
+                            ORDER BY id LIMIT ?)
+             RETURNING {cols}""",
+            (_iso(now + timedelta(seconds=ENRICH_LEASE_SEC)), _iso(now), limit),
         ).fetchall()
-    out = {}
-    for r in rows:
-        out.setdefault(r["cdate"], []).append(
-            {
-                **dict(r),
-                "analysis_html": markdown.markdown(r["analysis_ja"] or "", extensions=MD_EXT),
-            }
+
+def _record_failure(conn, table: str, row, err: Exception):
+    status = "failed" if row["enrich_attempts"] >= ENRICH_MAX_ATTEMPTS else "pending"
+    conn.execute(
+        f"UPDATE {table} SET enrich_status=?, enrich_error=?, lease_until=NULL WHERE id=?",
+        (status, str(err)[:500], row["id"]),
+    )
+
+def _enrich_paper(title_en: str, abstract_en: str) -> tuple:
+    """翻訳と解析を行い、papers の UPDATE 用の値を返す。
+
+    翻訳に失敗したら原文で代用せずに送出し、行は _record_failure で再試行に回す
+    """
+    title_ja = translate_text_openai(title_en, strict=True)
+    abstract_ja = translate_text_openai(abstract_en, strict=True)
+    analysis_ja, tweet_ja = generate_analysis(title_ja, abstract_ja)
+    now = datetime.now(timezone.utc).isoformat(timespec="seconds")
+    return title_ja, abstract_ja, analysis_ja, render_md(analysis_ja), HTML_VER, tweet_ja, now
+
+def enrich_papers(workers: int = ARXIV_WORKERS) -> int:
+    rows = _claim("papers", "id,title_en,abstract_en,enrich_attempts", ENRICH_BATCH)
+    if not rows:
+        return 0
+    # LLM 待ちが支配的なので論文単位でスレッドプールに流す
+    done, failed = [], []
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futs = {pool.submit(_enrich_paper, r["title_en"], r["abstract_en"]): r for r in rows}
+        for fut in as_completed(futs):
+            try:
+                done.append((*fut.result(), futs[fut]["id"]))
+            except Exception as e:
+                failed.append((futs[fut], e))
+                print("    ⚠️ enrich failed: paper", futs[fut]["id"], e)
+    with get_db() as conn:
+        conn.executemany(
+            """UPDATE papers
+                  SET title_ja=?, abstract_ja=?, analysis_ja=?, analysis_html=?, html_ver=?,
+                      tweet_ja=?, translated_at=?,
+                      enrich_status='done', enrich_error=NULL, lease_until=NULL
+                WHERE id=?""",
+            done,
         )
-    return sorted(out.items(), reverse=True)
+        for r, e in failed:
+            _record_failure(conn, "papers", r, e)
+    return len(done)
 
-def ext_by_cat(fav: bool = False, days: int = 90, limit: int = 60):
-    where = "WHERE favorite=1" if fav else ""
-    with closing(get_db()) as conn:
+def enrich_articles() -> int:
+    rows = _claim("articles", "id,title_en,summary_en,enrich_attempts", ENRICH_BATCH * 5)
+    if not rows:
+        return 0
+    n, errors = len(rows), {}
+    try:
+        # タイトルと要約をまとめてバッチ翻訳。訳せなかった項目は errors に入り、その行だけ再試行に回す
+        ja = translate_many([r["title_en"] for r in rows] + [r["summary_en"] or "" for r in rows], errors=errors)
+    except Exception as e:
+        with get_db() as conn:
+            for r in rows:
+                _record_failure(conn, "articles", r, e)
+        print("    ⚠️ enrich failed: articles", e)
+        return 0
+    done, failed = [], []
+    for i, r in enumerate(rows):
+        e = errors.get(i) or errors.get(n + i)
+        if e:
+            failed.append((r, e))
+            print("    ⚠️ enrich failed: article", r["id"], e)
+        else:
+            done.append((ja[i], ja[n + i] or None, r["id"]))
+    with get_db() as conn:
+        conn.executemany(
+            """UPDATE articles
+                  SET title_ja=?, summary_ja=?,
+                      enrich_status='done', enrich_error=NULL, lease_until=NULL
+                WHERE id=?""",
+            done,
+        )
+        for r, e in failed:
+            _record_failure(conn, "articles", r, e)
+    return len(done)
+
+def enrich_pending(workers: int = ARXIV_WORKERS):
+    """キューが空になるまで論文・記事のエンリッチを繰り返す"""
+    print("[enrich] start")
+    t0 = time.perf_counter()
+    papers = articles = 0
+    while True:
+        n_p, n_a = enrich_papers(workers), enrich_articles()
+        papers, articles = papers + n_p, articles + n_a
+        if n_p or n_a:
+            bump_data_version()
+        else:
+            break
+    with get_db() as conn:
+        secs = time.perf_counter() - t0
+        _record_runs(conn, [("enrich", "papers", papers, secs, 1), ("enrich", "articles", articles, secs, 1)])
+        import related_util
+
+        # abstract_en と analysis_ja の揃った行だけを関連論文索引に追加する
+        indexed = related_util.sync(related_index_path(), conn)
+    if indexed:
+        bump_data_version()     # 追加した論文の詳細ページに関連欄が付くので ETag を変える
+    print(f"  papers={papers} articles={articles} (related index +{indexed})")
+    _report_translation_cache()
+    print("[enrich] end")
+
+def run_worker(workers: int = ARXIV_WORKERS, poll_feeds: bool = False):
+    """APScheduler で enrich_pending (と poll_feeds なら poll_due_feeds) を定期実行する常駐ワーカー"""
+    from apscheduler.schedulers.blocking import BlockingScheduler
+
+    sched = BlockingScheduler()
+    sched.add_job(
+        enrich_pending, "interval", args=[workers], seconds=ENRICH_INTERVAL_SEC,
+        max_instances=1, coalesce=True, next_run_time=datetime.now(),
+    )
+    print(f"[worker] enrich every {ENRICH_INTERVAL_SEC}s")
+    if poll_feeds:
+        # 翻訳は上の enrich ジョブに任せ、ここでは取り込みだけ行う
+        sched.add_job(
+            poll_due_feeds, "interval", seconds=FEED_TICK_SEC,
+            max_instances=1, coalesce=True, next_run_time=datetime.now(),
+        )
+        print(f"[worker] feeds: adaptive polling, checked every {FEED_TICK_SEC}s")
+    try:
+        sched.start()
+    except (KeyboardInterrupt, SystemExit):
+        pass
+
+# ───────────────────────── UI Helpers
+
+# トップページは日付ごとの断片 (fragment) の並び。最初のレスポンスには直近 INDEX_DAYS 日分だけを入れ、
+# それより古い日は /fragment/<kind>/<date> をスクロールに合わせて読み込む。
+INDEX_DAYS = int(os.getenv("INDEX_DAYS", "3"))
+EXT_DAY_LIMIT = int(os.getenv("EXT_DAY_LIMIT", "60"))              # 外部フィードの 1 日あたり最大件数
+FRAGMENT_CACHE_SIZE = int(os.getenv("FRAGMENT_CACHE_SIZE", "1024"))
+DAY_KINDS = ("arxiv", "paper", "news", "blog")
+
+def _day_scope(kind: str, fav: bool) -> tuple[str, str, list]:
+    """(テーブル, WHERE 句, パラメータ)"""
+    conds, params = ["1=1"], []
+    if kind != "arxiv":
+        conds.append("category=?")
+        params.append(kind)
+    if fav:
+        conds.append("favorite=1")
+    return ("papers" if kind == "arxiv" else "articles"), " AND ".join(conds), params
+
+DAY_SEC = 86400
+
+def _day_start(d: str) -> int:
+    """'YYYY-MM-DD' (UTC) の 0 時の unix time。created_day * DAY_SEC と同じ値"""
+    return int(datetime.strptime(d, "%Y-%m-%d").replace(tzinfo=timezone.utc).timestamp())
+
+def _day_str(day: int) -> str:
+    return datetime.fromtimestamp(day * DAY_SEC, timezone.utc).strftime("%Y-%m-%d")
+
+def recent_days(kind: str, fav: bool = False, before: str | None = None, n: int = INDEX_DAYS) -> list[str]:
+    """before より前で行がある日付を新しい順に n 個返す。
+
+    DISTINCT で全件を見ずに、created_ts 索引を 1 日 1 回だけ引く (スキップスキャン)。
+    """
+    table, where, params = _day_scope(kind, fav)
+    days = []
+    with get_db() as conn:
+        bound = _day_start(before) if before else None
+        while len(days) < n:
+            row = conn.execute(
+                f"""SELECT created_day FROM {table}
+                     WHERE {where} {"AND created_ts < ?" if bound is not None else ""}
+                  ORDER BY created_ts DESC LIMIT 1""",
+                params + ([bound] if bound is not None else []),
+            ).fetchone()
+            if not row or row[0] is None:
+                break
+            days.append(_day_str(row[0]))
+            bound = row[0] * DAY_SEC
+    return days
+
+def day_items(kind: str, d: str, fav: bool = False) -> list[dict]:
+    """1 日分の論文 / 記事 (新しい順)"""
+    table, where, params = _day_scope(kind, fav)
+    span = [_day_start(d), _day_start(d) + DAY_SEC]
+    with get_db() as conn:
+        if kind != "arxiv":
+            return [dict(r) for r in conn.execute(
+                f"""SELECT id,title_en,title_ja,summary_en,summary_ja,source_id,favorite,category
+                      FROM articles WHERE {where} AND created_ts >= ? AND created_ts < ?
+                  ORDER BY created_ts DESC, id DESC LIMIT ?""",
+                params + span + [EXT_DAY_LIMIT],
+            )]
         rows = conn.execute(
-            f"""
-            SELECT *,substr(created_at,1,10) AS cdate FROM articles {where}
-        ORDER BY created_at DESC"""
+            f"""SELECT id,title_ja,title_en,favorite,pdf_url,created_at,enrich_status,
+                       CASE WHEN html_ver=? THEN analysis_html END AS analysis_html,
+                       CASE WHEN html_ver=? THEN NULL ELSE analysis_ja END AS analysis_ja,
+                       CASE WHEN analysis_ja IS NULL THEN abstract_en END AS abstract_en
+                  FROM papers WHERE {where} AND created_ts >= ? AND created_ts < ?
+              ORDER BY created_ts DESC, id DESC""",
+            [HTML_VER, HTML_VER] + params + span,
         ).fetchall()
-    cats = {"paper": {}, "news": {}, "blog": {}}
-    for r in rows:
-        g = cats[r["category"]].setdefault(r["cdate"], [])
-        if len(g) < limit:
-            g.append(r)
-    for cat in cats:
-        cats[cat] = dict(list(cats[cat].items())[: days])
-    return cats
+    return [
+        {**dict(r), "analysis_html": r["analysis_html"] if r["analysis_html"] is not None else render_md(r["analysis_ja"])}
+        for r in rows
+    ]
+
+def _day_fingerprint(kind: str, d: str, fav: bool) -> tuple:
+    """その日の表示内容が変わったかを安く判定する値 (件数・最大 id・お気に入り・翻訳済み・HTML 版)"""
+    table, where, params = _day_scope(kind, fav)
+    html_ver = ", TOTAL(html_ver=?)" if kind == "arxiv" else ""
+    with get_db() as conn:
+        return tuple(conn.execute(
+            f"""SELECT COUNT(*), MAX(id), TOTAL(favorite), TOTAL(enrich_status='done'){html_ver}
+                  FROM {table} WHERE {where} AND created_ts >= ? AND created_ts < ?""",
+            ([HTML_VER] if html_ver else []) + params + [_day_start(d), _day_start(d) + DAY_SEC],
+        ).fetchone())
+
+_fragment_cache: OrderedDict = OrderedDict()
+_fragment_lock = threading.Lock()
+
+def day_fragment(kind: str, d: str, fav: bool = False) -> tuple[str, str] | None:
+    """1 日分の HTML 断片と ETag を返す (行が無ければ None)。
+
+    過去の日はほぼ変わらないので、描画結果を指紋付きでプロセス内にキャッシュし、
+    お気に入りや翻訳で指紋が変わったときだけ描き直す。
+    """
+    fp = _day_fingerprint(kind, d, fav)
+    if not fp[0]:
+        return None
+    key = (kind, d, fav)
+    with _fragment_lock:
+        hit = _fragment_cache.get(key)
+        if hit and hit[0] == fp:
+            _fragment_cache.move_to_end(key)
+            return hit[1], hit[2]
+    older = recent_days(kind, fav, before=d, n=1)
+    html = render_template(
+        "_day.html", kind=kind, d=d, fav=fav, items=day_items(kind, d, fav),
+        next_date=older[0] if older else None,
+    )
+    etag = hashlib.sha1(f"{key}|{fp}|{_asset_version()}".encode()).hexdigest()[:32]
+    with _fragment_lock:
+        _fragment_cache[key] = (fp, html, etag)
+        _fragment_cache.move_to_end(key)
+        while len(_fragment_cache) > FRAGMENT_CACHE_SIZE:
+            _fragment_cache.popitem(last=False)
+    return html, etag
+
+# ───────────────────────── HTTP キャッシュ (ETag)
+# 表示内容が変わる書き込み (取り込み・お気に入り・Q&A) のたびに更新するバージョン。
+# cron の取り込みは別プロセスなので、DB の隣のファイルで共有する。
+VERSION_PATH = DB_PATH + ".version"
+
+def data_version() -> str:
+    try:
+        with open(VERSION_PATH, encoding="ascii") as f:
+            return f.read().strip() or "0"
+    except OSError:
+        return "0"
+
+def bump_data_version():
+    # プロセス間で同じ値を書かないよう時刻と比較して単調増加させる
+    try:
+        cur = int(data_version())
+    except ValueError:
+        cur = 0
+    tmp = f"{VERSION_PATH}.{os.getpid()}.{threading.get_ident()}"   # 同じプロセスの別スレッドとも衝突させない
+    with open(tmp, "w", encoding="ascii") as f:
+        f.write(str(max(cur + 1, time.time_ns())))
+    os.replace(tmp, VERSION_PATH)
+
+@functools.cache
+def _asset_version() -> str:
+    """テンプレートと Markdown 描画設定のハッシュ。デプロイで変わればETagも変わる"""
+    h = hashlib.sha1(HTML_VER.encode())
+    tdir = os.path.join(app.root_path, "templates")
+    for name in sorted(os.listdir(tdir)):
+        with open(os.path.join(tdir, name), "rb") as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+def etag_cached(view):
+    """データバージョンとリクエストパスから強い ETag を作り、一致すれば 304 を返す"""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        etag = hashlib.sha1(
+            f"{data_version()}|{_asset_version()}|{request.full_path}".encode()
+        ).hexdigest()[:32]
+        if request.if_none_match.contains(etag):
+            resp = make_response("", 304)
+            resp.set_etag(etag)
+            return resp
+        resp = make_response(view(*args, **kwargs))
+        if resp.status_code == 200:
+            resp.set_etag(etag)
+            resp.headers["Cache-Control"] = "no-cache"
+        return resp
+    return wrapper
 
 # ───────────────────────── Routes
+def _valid_day(d: str | None) -> str | None:
+    try:
+        return datetime.strptime(d or "", "%Y-%m-%d").strftime("%Y-%m-%d")
+    except ValueError:
+        return None
+
 def _render_index(fav: bool = False):
-    arxiv = group_arxiv(fav)
+    # トップは 4 種類のタブ、お気に入りページはお気に入りタブだけを描画する
+    before = _valid_day(request.args.get("before"))
+    days = {kind: recent_days(kind, fav, before) for kind in DAY_KINDS}
+    sections = {kind: [day_fragment(kind, d, fav)[0] for d in ds] for kind, ds in days.items()}
+    # JS なしでも辿れるよう、種類ごとに表示中で最も古い日より前へのリンクを出す
+    older = {kind: ds[-1] for kind, ds in days.items() if len(ds) == INDEX_DAYS}
+    tab = request.args.get("tab", "arxiv")
     return render_template(
         "index.html",
-        arxiv_days=dict(arxiv),
-        ordered_dates=[d for d, _ in arxiv],
-        ext_by_cat=ext_by_cat(fav),
+        sections=sections,
         fav_only=fav,
+        initial_tab="favorites" if fav else (tab if tab in DAY_KINDS else "arxiv"),
+        older=older,
     )
 
 @app.route("/")
+@etag_cached
 def index():
     return _render_index(False)
 
 @app.route("/favorites")
+@etag_cached
 def favorites():
     # お気に入り表示用のページをレンダリング
     return _render_index(True)
 
+@app.route("/fragment/<kind>/<date>")
+def fragment(kind: str, date: str):
+    """トップページの 1 日分 (?fav=1 でお気に入りのみ)。無限スクロールから読み込む"""
+    if kind not in DAY_KINDS or _valid_day(date) != date:
+        return "", 404
+    frag = day_fragment(kind, date, request.args.get("fav") == "1")
+    if frag is None:
+        return "", 404
+    html, etag = frag
+    if request.if_none_match.contains(etag):
+        resp = make_response("", 304)
+    else:
+        resp = make_response(html)
+        resp.headers["Cache-Control"] = "no-cache"
+    resp.set_etag(etag)
+    return resp
+
 @app.route("/article/<int:article_id>")
+@etag_cached
 def article_detail(article_id: int):
     """外部フィード記事の詳細ページ"""
     # article_idがどのテーブルに属するか確認
     article_type = "article"  # articleか paperか
     
-    with closing(get_db()) as conn:
+    with get_db() as conn:
         # まずparticlesテーブルを探す
         a = conn.execute("SELECT * FROM articles WHERE id=?", (article_id,)).fetchone()
         if not a:
@@ -271,21 +950,6 @@ def article_detail(article_id: int):
                 return redirect(url_for("index"))
             article_type = "paper"  # これはarXiv論文
         
-        # article_qa テーブルが存在しない場合は作成
-        try:
-            conn.execute("SELECT 1 FROM article_qa LIMIT 1")
-        except sqlite3.OperationalError:
-            conn.execute("""
-                CREATE TABLE IF NOT EXISTS article_qa (
-                    id          INTEGER PRIMARY KEY AUTOINCREMENT,
-                    article_id  INTEGER NOT NULL REFERENCES articles(id) ON DELETE CASCADE,
-                    question    TEXT NOT NULL,
-                    answer_md   TEXT NOT NULL,
-                    created_at  DATETIME DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-            conn.commit()
-        
         # Q&Aデータを取得
         qa_list = []
         if article_type == "article":
@@ -298,7 +962,7 @@ def article_detail(article_id: int):
                 qa_list = [
                     {
                         "question": q["question"],
-                        "answer_html": markdown.markdown(q["answer_md"], extensions=MD_EXT),
+                        "answer_html": stored_html(q, "answer_md", "answer_html"),
                         "created_at": q["created_at"][:10],
                     }
                     for q in qa
@@ -313,7 +977,7 @@ def article_detail(article_id: int):
                 qa_list = [
                     {
                         "question": q["question"],
-                        "answer_html": markdown.markdown(q["answer_md"], extensions=MD_EXT),
+                        "answer_html": stored_html(q, "answer_md", "answer_html"),
                         "created_at": q["created_at"][:10],
                     }
                     for q in qa
@@ -348,50 +1012,308 @@ def article_detail(article_id: int):
         article_type=article_type
     )
 
+RELATED_K = int(os.getenv("RELATED_K", "5"))
+
 @app.route("/paper/<int:paper_id>")
+@etag_cached
 def paper_detail(paper_id: int):
     """arXiv論文の詳細ページ"""
-    with closing(get_db()) as conn:
+    with get_db() as conn:
         p = conn.execute("SELECT * FROM papers WHERE id=?", (paper_id,)).fetchone()
         if not p:
             return redirect(url_for("index"))
         qa = conn.execute(
             "SELECT * FROM qa WHERE paper_id=? ORDER BY created_at DESC", (paper_id,)
         ).fetchall()
-    analysis_html = markdown.markdown(p["analysis_ja"] or "", extensions=MD_EXT)
+        import related_util
+
+        neighbours = related_util.related(related_index_path(), paper_id, RELATED_K)
+        titles = {
+            r["id"]: r["title_ja"] or r["title_en"]
+            for r in conn.execute(
+                f"SELECT id,title_ja,title_en FROM papers WHERE id IN ({','.join('?' * len(neighbours))})",
+                [i for i, _ in neighbours],
+            )
+        } if neighbours else {}
+    related = [{"id": i, "title": titles[i], "score": sc} for i, sc in neighbours if i in titles]
+    analysis_html = stored_html(p, "analysis_ja", "analysis_html")
     qa_list = [
         {
             "question": q["question"],
-            "answer_html": markdown.markdown(q["answer_md"], extensions=MD_EXT),
+            "answer_html": stored_html(q, "answer_md", "answer_html"),
             "created_at": q["created_at"][:10],
         }
         for q in qa
     ]
-    return render_template("paper.html", paper=p, analysis_html=analysis_html, qa_list=qa_list)
+    return render_template(
+        "paper.html", paper=p, analysis_html=analysis_html, qa_list=qa_list, related=related
+    )
 
 @app.route("/api/favorite/<tbl>/<int:rid>", methods=["POST"])
 def api_fav(tbl: str, rid: int):
     fav = 1 if request.json.get("favorite") else 0
     table = "papers" if tbl == "paper" else "articles"
-    with closing(get_db()) as conn:
+    with get_db() as conn:
         conn.execute(f"UPDATE {table} SET favorite=? WHERE id=?", (fav, rid))
         conn.commit()
+    bump_data_version()
     return jsonify(ok=True, favorite=bool(fav))
 
+# ───────────────────────── 検索
+# kind: (FTS, 展開ビュー, 元テーブル, 検索対象の列)
+SEARCH_TABLES = {
+    "paper":   ("papers_fts", "papers_text", "papers", ("title_en", "title_ja", "abstract_en", "abstract_ja", "analysis_ja")),
+    "article": ("articles_fts", "articles_text", "articles", ("title_en", "title_ja", "summary_en", "summary_ja")),
+}
+SEARCH_SNIPPET_CHARS = 24
+# 3 文字未満の語は索引を引けず本文を走査するので、kind ごとに新しい方からこの行数までに限る
+SEARCH_SHORT_SCAN = int(os.getenv("SEARCH_SHORT_SCAN", "10000"))
+
+def _search_sql(kind: str, match: bool, n_short: int) -> str:
+    """kind 1 種類分の検索 SQL。3 文字未満の語 (:s0, :s1, ...) は展開ビューの本文を instr で絞り込む"""
+    fts, view, table, cols = SEARCH_TABLES[kind]
+    doc = "||char(10)||".join(f"COALESCE(t.{c},'')" for c in cols)
+    short = "".join(f" AND instr(lower({doc}), :s{i}) > 0" for i in range(n_short))
+    if n_short:
+        short = f""" AND r.created_ts >= COALESCE(
+                (SELECT created_ts FROM {table} ORDER BY created_ts DESC LIMIT 1 OFFSET :scan), 0){short}"""
+    head = f"""
+        SELECT '{kind}' AS kind, r.id, COALESCE(r.title_ja, r.title_en) AS title,
+               substr(r.created_at,1,10) AS cdate,"""
+    if match:
+        return head + f"""
+               snippet({fts}, -1, char(2), char(3), '…', {SEARCH_SNIPPET_CHARS}) AS snip,
+               bm25({fts}) AS score
+          FROM {fts} JOIN {table} r ON r.id = {fts}.rowid
+               {f"JOIN {view} t ON t.id = r.id" if n_short else ""}
+         WHERE {fts} MATCH :q{short}"""
+    # 3 文字未満の語だけのときは索引を引けないので、新しい順に走査して必要な件数で打ち切る
+    return head + f"""
+               {doc} AS doc, r.created_ts AS score
+          FROM {table} r JOIN {view} t ON t.id = r.id
+         WHERE 1=1{short}
+      ORDER BY r.created_ts DESC LIMIT :limit"""
+
+def fts_query(text: str) -> tuple[str | None, list[str]]:
+    """入力語を (FTS5 クエリ, 3 文字未満の語) に分ける。
+
+    3 文字以上の語はそれぞれフレーズとして AND 検索する FTS5 クエリにする (無ければ None)。
+    trigram の索引では 3 文字未満の語を引けないので、それらは小文字にして別に返す。
+    """
+    terms = unicodedata.normalize("NFKC", text).split()
+    long = [t for t in terms if len(t) >= 3]
+    match = " ".join('"' + t.replace('"', '""') + '"' for t in long) if long else None
+    return match, [t.lower() for t in terms if len(t) < 3]
+
+def _short_snippet(doc: str, terms: list[str]) -> str:
+    """最初に見つかった語の前後を切り出し、snippet() と同じく語を char(2) / char(3) で囲む"""
+    low = doc.lower()
+    pos = min((p for p in (low.find(t) for t in terms) if p >= 0), default=0)
+    start = max(pos - SEARCH_SNIPPET_CHARS, 0)
+    end = min(pos + SEARCH_SNIPPET_CHARS * 2, len(doc))
+    piece = re.sub("|".join(map(re.escape, terms)), lambda m: f"\x02{m.group(0)}\x03",
+                   doc[start:end].replace("\n", " "), flags=re.I)
+    return ("…" if start else "") + piece + ("…" if end < len(doc) else "")
+
+@app.route("/api/search")
+def api_search():
+    """
+    クエリ: ?q=検索語&kind=all|paper|article&page=1&per_page=20
+    返り値:
+      {
+        "q": "検索語", "page": 1, "has_more": false,
+        "results": [{"kind": "paper", "id": 1, "title": "...", "snippet": "...<mark>語</mark>...",
+                     "url": "/paper/1", "created_at": "YYYY-MM-DD"}]
+      }
+    3 文字以上の語があれば bm25 順、3 文字未満の語 (RL, 強化 など) だけなら新しい順。
+    3 文字未満の語は索引を使えないので、kind ごとに新しい SEARCH_SHORT_SCAN 行の中だけを探す。
+    """
+    q = request.args.get("q", "").strip()
+    kind = request.args.get("kind", "all")
+    page = max(request.args.get("page", 1, type=int), 1)
+    per_page = min(max(request.args.get("per_page", 20, type=int), 1), 100)
+    match, short = fts_query(q)
+    if match is None and not short:
+        return jsonify(error="検索語を指定してください"), 400
+    if kind not in ("all", "paper", "article"):
+        return jsonify(error="invalid kind"), 400
+
+    kinds = list(SEARCH_TABLES) if kind == "all" else [kind]
+    params = {"q": match, "scan": SEARCH_SHORT_SCAN, **{f"s{i}": t for i, t in enumerate(short)}}
+    offset = (page - 1) * per_page
+    with get_db() as conn:
+        if match is not None:
+            sql = " UNION ALL ".join(_search_sql(k, True, len(short)) for k in kinds)
+            rows = conn.execute(
+                sql + " ORDER BY score LIMIT :limit OFFSET :offset",
+                {**params, "limit": per_page + 1, "offset": offset},
+            ).fetchall()
+        else:
+            # kind ごとに新しい順で必要な件数だけ取り、まとめて並べ直す
+            rows = []
+            for k in kinds:
+                rows += conn.execute(_search_sql(k, False, len(short)), {**params, "limit": offset + per_page + 1})
+            rows = sorted(rows, key=lambda r: r["score"], reverse=True)[offset : offset + per_page + 1]
+    results = [
+        {
+            "kind": r["kind"],
+            "id": r["id"],
+            "title": r["title"],
+            "snippet": str(escape((r["snip"] or "") if match is not None else _short_snippet(r["doc"], short)))
+                       .replace("\x02", "<mark>").replace("\x03", "</mark>"),
+            "url": url_for("paper_detail", paper_id=r["id"]) if r["kind"] == "paper"
+                   else url_for("article_detail", article_id=r["id"]),
+            "created_at": r["cdate"],
+        }
+        for r in rows[:per_page]
+    ]
+    return jsonify(q=q, page=page, has_more=len(rows) > per_page, results=results)
+
 # ───────────────────────── Q&A API
+QA_MODEL = os.getenv("OPENAI_MODEL_NAME", "gpt-4o-mini")
+
+QA_CONTEXT_TOKENS = int(os.getenv("QA_CONTEXT_TOKENS", "3000"))   # 質問に添える本文の上限
+# LLM を呼ぶ Q&A リクエストを同時に受け付ける数。回答 (SSE なら送り終わるまで) の間
+# スレッドを 1 本占有するので、これを超えた分は待たせずに 503 を返す。serve() はこの本数を
+# ページ表示用のスレッドに上乗せする
+QA_MAX_ACTIVE = int(os.getenv("QA_MAX_ACTIVE", str(llm_util.MAX_CONCURRENCY)))
+# LLM の同時実行枠 (LLM_CONCURRENCY) が埋まっているとき、Q&A が空きを待つ秒数。
+# 超えたら 503 を返す (受付済みのスレッドの中でだけ待つ)
+QA_WAIT_SEC = float(os.getenv("QA_LLM_WAIT_SEC", "2"))
+
+_qa_active = threading.BoundedSemaphore(QA_MAX_ACTIVE)
+
+def _qa_context(text: str) -> str:
+    """質問文は残し、添える本文 (解析・要約) だけをトークン上限で切り詰める"""
+    return llm_util.truncate(text, QA_CONTEXT_TOKENS, QA_MODEL)
+
+def _qa_completion(msgs) -> str:
+    @llm_util.retry(max_tries=3)
+    def _call():
+        return llm_util.chat("qa", msgs, model=QA_MODEL, wait=QA_WAIT_SEC, temperature=0.3)
+
+    return _call()
+
+# 既存回答の再利用。0 なら正規化後の完全一致のみ、0〜1 を指定すると類似度で近い質問も拾う
+QA_SIMILARITY = float(os.getenv("QA_SIMILARITY", "0"))
+
+def normalize_question(q: str) -> str:
+    """全角/半角 (NFKC)・大文字小文字・空白・句読点と記号の違いを吸収する"""
+    q = unicodedata.normalize("NFKC", q).casefold()
+    return "".join(
+        ch for ch in q if not ch.isspace() and not unicodedata.category(ch).startswith(("P", "S"))
+    )
+
+def find_answer(table: str, key_col: str, key: int, question: str, threshold: float = QA_SIMILARITY):
+    """同じ対象への過去の質問から一致 (または類似度 threshold 以上) するものを返す"""
+    norm = normalize_question(question)
+    with get_db() as conn:
+        rows = conn.execute(
+            f"SELECT * FROM {table} WHERE {key_col}=? ORDER BY created_at DESC", (key,)
+        ).fetchall()
+    best, best_score = None, 0.0
+    for r in rows:
+        other = normalize_question(r["question"])
+        if other == norm:
+            return r
+        if threshold > 0:
+            score = difflib.SequenceMatcher(None, norm, other).ratio()
+            if score >= threshold and score > best_score:
+                best, best_score = r, score
+    return best
+
+def _qa_cached_response(row, question: str, stream: bool):
+    """保存済みの回答を通常モード / SSE モードの形式で返す"""
+    body = dict(
+        answer_html=stored_html(row, "answer_md", "answer_html"),
+        question=question,
+        created_at=row["created_at"][:10],
+        cached=True,
+    )
+    if not stream:
+        return jsonify(**body)
+    return Response(_sse(body, "done"), mimetype="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+def _sse(data: dict, event: str | None = None) -> str:
+    head = f"event: {event}\n" if event else ""
+    return head + "data: " + json.dumps(data, ensure_ascii=False) + "\n\n"
+
+def _qa_busy():
+    resp = jsonify(error="混み合っています。しばらくしてから再度お試しください。")
+    resp.status_code = 503
+    resp.headers["Retry-After"] = "5"
+    return resp
+
+def _qa_response(msgs, question: str, save, stream: bool):
+    """回答を生成して save(answer_md, answer_html) で保存し、JSON か SSE で返す。
+
+    stream=True のときはトークンを `data: {"delta": ...}` で逐次送り、完了時に
+    `event: done` で通常モードと同じ JSON を送る。クライアントが切断した場合は
+    上流のストリームも閉じ、途中までの回答は保存しない。
+    受付枠 (QA_MAX_ACTIVE) が埋まっていれば LLM を呼ばずにすぐ 503 を返す。
+    """
+    if not _qa_active.acquire(blocking=False):
+        metrics_util.LLM_REJECTED.inc(func="qa_stream" if stream else "qa")
+        return _qa_busy()
+    created_at = datetime.now().strftime("%Y-%m-%d")
+    if not stream:
+        try:
+            answer_md = _qa_completion(msgs)
+        except llm_util.Busy:
+            return _qa_busy()
+        finally:
+            _qa_active.release()
+        answer_html = render_md(answer_md)
+        save(answer_md, answer_html)
+        return jsonify(answer_html=answer_html, question=question, created_at=created_at)
+
+    import openai
+
+    def events():
+        parts = []
+        try:
+            upstream = llm_util.chat_stream("qa_stream", msgs, model=QA_MODEL, wait=QA_WAIT_SEC, temperature=0.3)
+            for delta in upstream:
+                parts.append(delta)
+                yield _sse({"delta": delta})
+        except llm_util.Busy:
+            yield _sse({"error": "混み合っています。しばらくしてから再度お試しください。"}, "error")
+            return
+        except openai.OpenAIError as e:
+            yield _sse({"error": str(e)}, "error")
+            return
+        finally:
+            upstream.close()   # 切断 (GeneratorExit) 時も上流のリクエストを止める
+        answer_md = "".join(parts).strip()
+        answer_html = render_md(answer_md)
+        save(answer_md, answer_html)
+        yield _sse(dict(answer_html=answer_html, question=question, created_at=created_at), "done")
+
+    resp = Response(
+        stream_with_context(events()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+    # 送り終わり・切断のどちらでも WSGI サーバーが close() を呼んだ時点で枠を返す
+    resp.call_on_close(_qa_active.release)
+    return resp
+
 @app.route("/api/ask", methods=["POST"])
 def api_ask():
     """
     JSON 形式:
       {
         "paper_id": 123,
-        "question": "〜〜とは何ですか？"
+        "question": "〜〜とは何ですか？",
+        "stream": false,           # true なら text/event-stream で逐次返す
+        "force_refresh": false     # true なら過去の同じ質問への回答を使わない
       }
     返り値:
       {
         "answer_html": "<p>回答 (Markdown → HTML)</p>",
         "question": "質問",
-        "created_at": "YYYY-MM-DD"
+        "created_at": "YYYY-MM-DD",
+        "cached": true             # 過去の回答を再利用した場合のみ
       }
     """
     data = request.json or {}
@@ -403,54 +1325,43 @@ def api_ask():
     if not question:
         return jsonify(error="empty question"), 400
 
-    with closing(get_db()) as conn:
+    with get_db() as conn:
         p = conn.execute("SELECT * FROM papers WHERE id=?", (pid,)).fetchone()
     if not p:
         return jsonify(error="paper not found"), 404
-
-    import openai
-
-    @backoff.on_exception(backoff.expo, openai.OpenAIError, max_tries=3)
-    def _chat_completion(msgs):
-        return (
-            openai.chat.completions.create(
-                model=os.getenv("OPENAI_MODEL_NAME", "gpt-4o-mini"),
-                messages=msgs,
-                temperature=0.3,
-            )
-            .choices[0]
-            .message.content.strip()
-        )
+    if not data.get("force_refresh"):
+        hit = find_answer("qa", "paper_id", pid, question)
+        if hit:
+            return _qa_cached_response(hit, question, bool(data.get("stream")))
 
     system_prompt = "あなたは論文解説アシスタントです。回答は日本語で Markdown 形式で返してください。"
     user_prompt = f"""論文タイトル:
-{p["title_ja"]}
+{p["title_ja"] or p["title_en"]}
 
 要約:
-{p["analysis_ja"]}
+{_qa_context(p["analysis_ja"] or p["abstract_en"])}
 
 質問:
 {question}
 """
-    answer_md = _chat_completion(
+
+    def save(answer_md: str, answer_html: str):
+        with get_db() as conn:
+            conn.execute(
+                "INSERT INTO qa (paper_id, question, answer_md, answer_html, html_ver) VALUES (?,?,?,?,?)",
+                (pid, question, answer_md, answer_html, HTML_VER),
+            )
+            conn.commit()
+        bump_data_version()
+
+    return _qa_response(
         [
             {"role": "system", "content": system_prompt},
             {"role": "user", "content": user_prompt},
-        ]
-    )
-
-    with closing(get_db()) as conn:
-        conn.execute(
-            "INSERT INTO qa (paper_id, question, answer_md) VALUES (?,?,?)",
-            (pid, question, answer_md),
-        )
-        conn.commit()
-
-    answer_html = markdown.markdown(answer_md, extensions=MD_EXT)
-    return jsonify(
-        answer_html=answer_html,
-        question=question,
-        created_at=datetime.now().strftime("%Y-%m-%d"),
+        ],
+        question,
+        save,
+        bool(data.get("stream")),
     )
 
 @app.route("/api/ask-article", methods=["POST"])
@@ -460,13 +1371,16 @@ def api_ask_article():
     JSON 形式:
       {
         "article_id": 123,
-        "question": "この記事について教えてください"
+        "question": "この記事について教えてください",
+        "stream": false,           # true なら text/event-stream で逐次返す
+        "force_refresh": false     # true なら過去の同じ質問への回答を使わない
       }
     返り値:
       {
         "answer_html": "<p>回答 (Markdown → HTML)</p>",
         "question": "質問",
-        "created_at": "YYYY-MM-DD"
+        "created_at": "YYYY-MM-DD",
+        "cached": true             # 過去の回答を再利用した場合のみ
       }
     """
     data = request.json or {}
@@ -478,24 +1392,14 @@ def api_ask_article():
     if not question:
         return jsonify(error="empty question"), 400
 
-    with closing(get_db()) as conn:
+    with get_db() as conn:
         a = conn.execute("SELECT * FROM articles WHERE id=?", (article_id,)).fetchone()
     if not a:
         return jsonify(error="article not found"), 404
-
-    import openai
-
-    @backoff.on_exception(backoff.expo, openai.OpenAIError, max_tries=3)
-    def _chat_completion(msgs):
-        return (
-            openai.chat.completions.create(
-                model=os.getenv("OPENAI_MODEL_NAME", "gpt-4o-mini"),
-                messages=msgs,
-                temperature=0.3,
-            )
-            .choices[0]
-            .message.content.strip()
-        )
+    if not data.get("force_refresh"):
+        hit = find_answer("article_qa", "article_id", article_id, question)
+        if hit:
+            return _qa_cached_response(hit, question, bool(data.get("stream")))
 
     system_prompt = """あなたは記事解説アシスタントです。
 与えられたタイトルと要約に基づいて、質問に日本語で回答してください。
@@ -505,7 +1409,7 @@ def api_ask_article():
 {a["title_ja"] or a["title_en"]}
 
 要約:
-{a["summary_ja"] or a["summary_en"] or "要約なし"}
+{_qa_context(a["summary_ja"] or a["summary_en"] or "要約なし")}
 
 出典: {a["source_id"]}
 リンク: {a["link"]}
@@ -513,37 +1417,139 @@ def api_ask_article():
 質問:
 {question}
 """
-    answer_md = _chat_completion(
+
+    # 回答をデータベースに保存
+    def save(answer_md: str, answer_html: str):
+        with get_db() as conn:
+            conn.execute(
+                "INSERT INTO article_qa (article_id, question, answer_md, answer_html, html_ver) VALUES (?,?,?,?,?)",
+                (article_id, question, answer_md, answer_html, HTML_VER),
+            )
+            conn.commit()
+        bump_data_version()
+
+    return _qa_response(
         [
             {"role": "system", "content": system_prompt},
             {"role": "user", "content": user_prompt},
-        ]
+        ],
+        question,
+        save,
+        bool(data.get("stream")),
     )
 
-    # 回答をデータベースに保存
-    with closing(get_db()) as conn:
-        # article_qa テーブルが存在しない場合は作成
-        conn.execute("""
-            CREATE TABLE IF NOT EXISTS article_qa (
-                id          INTEGER PRIMARY KEY AUTOINCREMENT,
-                article_id  INTEGER NOT NULL REFERENCES articles(id) ON DELETE CASCADE,
-                question    TEXT NOT NULL,
-                answer_md   TEXT NOT NULL,
-                created_at  DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        conn.execute(
-            "INSERT INTO article_qa (article_id, question, answer_md) VALUES (?,?,?)",
-            (article_id, question, answer_md),
+# ───────────────────────── LLM 使用量
+@app.route("/api/llm-usage")
+def api_llm_usage():
+    """関数 × 日ごとの LLM 呼び出し数・トークン数・レイテンシ (?days=7)"""
+    days = min(max(request.args.get("days", 7, type=int), 1), 365)
+    return jsonify(days=days, rows=llm_util.report(days))
+
+def print_llm_report(days: int):
+    rows = llm_util.report(days)
+    print(f"{'day':<10} {'func':<16} {'calls':>6} {'err':>4} {'prompt':>9} {'compl':>8} {'avg ms':>7} {'max ms':>7}")
+    for r in rows:
+        print(f"{r['day']:<10} {r['func']:<16} {r['calls']:>6} {r['errors']:>4} "
+              f"{r['prompt_tokens'] or 0:>9} {r['completion_tokens'] or 0:>8} "
+              f"{r['avg_latency_ms'] or 0:>7} {r['max_latency_ms'] or 0:>7}")
+    print(f"total prompt={sum(r['prompt_tokens'] or 0 for r in rows)} "
+          f"completion={sum(r['completion_tokens'] or 0 for r in rows)}")
+
+# ───────────────────────── メトリクス
+@app.before_request
+def _start_timer():
+    g.t0 = time.perf_counter()
+
+@app.after_request
+def _keep_status(resp):
+    g.status = resp.status_code
+    return resp
+
+@app.teardown_request
+def _observe_request(exc):
+    t0 = g.pop("t0", None)
+    if t0 is not None:
+        metrics_util.HTTP_SECONDS.observe(
+            time.perf_counter() - t0,
+            route=request.url_rule.rule if request.url_rule else "<unmatched>",
+            method=request.method,
+            status=500 if exc else g.get("status", 500),
         )
-        conn.commit()
 
-    answer_html = markdown.markdown(answer_md, extensions=MD_EXT)
-    return jsonify(
-        answer_html=answer_html,
-        question=question,
-        created_at=datetime.now().strftime("%Y-%m-%d"),
+@app.route("/metrics")
+def metrics():
+    """Prometheus テキスト形式。取り込み・エンリッチは別プロセスなので ingest_runs から出す"""
+    with get_db() as conn:
+        runs = conn.execute("SELECT job, source, items, seconds, ok, finished_at FROM ingest_runs").fetchall()
+        polls = conn.execute(
+            "SELECT source_id, poll_interval, next_poll_at, failures FROM feed_state WHERE poll_interval IS NOT NULL"
+        ).fetchall()
+        pending = conn.execute(
+            """SELECT 'papers', COUNT(*) FROM papers WHERE enrich_status IN ('pending','running')
+               UNION ALL
+               SELECT 'articles', COUNT(*) FROM articles WHERE enrich_status IN ('pending','running')"""
+        ).fetchall()
+    extra = (
+        metrics_util.gauge_lines("neurascope_ingest_items", "Items stored by the last ingest run.",
+                                 ("job", "source"), [((r[0], r[1]), r[2]) for r in runs])
+        + metrics_util.gauge_lines("neurascope_ingest_duration_seconds", "Duration of the last ingest run.",
+                                   ("job", "source"), [((r[0], r[1]), round(r[3], 3)) for r in runs if r[3] is not None])
+        + metrics_util.gauge_lines("neurascope_ingest_success", "1 if the last ingest run succeeded.",
+                                   ("job", "source"), [((r[0], r[1]), r[4]) for r in runs])
+        + metrics_util.gauge_lines("neurascope_ingest_last_run_timestamp_seconds", "Unix time of the last ingest run.",
+                                   ("job", "source"), [((r[0], r[1]), r[5]) for r in runs])
+        + metrics_util.gauge_lines("neurascope_feed_poll_interval_seconds", "Adaptive polling interval per source.",
+                                   ("source",), [((r[0],), round(r[1])) for r in polls])
+        + metrics_util.gauge_lines("neurascope_feed_next_poll_timestamp_seconds", "Unix time of the next poll.",
+                                   ("source",), [((r[0],), r[2]) for r in polls])
+        + metrics_util.gauge_lines("neurascope_feed_consecutive_failures", "Consecutive fetch errors per source.",
+                                   ("source",), [((r[0],), r[3]) for r in polls])
+        + metrics_util.gauge_lines("neurascope_enrich_queue", "Rows waiting for enrichment.",
+                                   ("table",), [((t,), n) for t, n in pending])
+        + metrics_util.gauge_lines("neurascope_llm_in_flight", "LLM requests currently in flight in this process.",
+                                   (), [((), llm_util.in_flight())])
+        + metrics_util.gauge_lines("neurascope_llm_concurrency_limit", "Configured LLM concurrency limit.",
+                                   (), [((), llm_util.MAX_CONCURRENCY)])
     )
+    return Response(metrics_util.render(extra), mimetype="text/plain; version=0.0.4")
+
+# ───────────────────────── 本番配信
+WEB_THREADS = int(os.getenv("WEB_THREADS", "8"))   # ページ表示に確保するスレッド数
+
+def serve(host: str = "0.0.0.0", port: int = 8000, threads: int = WEB_THREADS):
+    """debug なし・マルチスレッドの WSGI サーバー (waitress) で配信する。
+
+    LLM を呼ぶ Q&A は回答を待つ間 (SSE なら送り終わるまで) スレッドを 1 本占有する。
+    同時に受け付けるのは QA_MAX_ACTIVE 本までで、溢れた分はスレッドを待たせずに
+    503 を返すので、その本数を上乗せしておけばページ表示には常に threads 本が残る。
+    gunicorn などで動かす場合は `app:app` を指定し、同じ考え方でスレッド数を決める。
+    """
+    import waitress
+
+    total = threads + QA_MAX_ACTIVE
+    print(f"[serve] http://{host}:{port} threads={total} (qa={QA_MAX_ACTIVE}, llm={llm_util.MAX_CONCURRENCY})")
+    waitress.serve(app, host=host, port=port, threads=total, ident="neurascope")
+
+# ───────────────────────── 保守 (コールド層の圧縮と VACUUM)
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "90"))   # これより古い行を圧縮する
+
+def run_maintenance(days: int | None = ARCHIVE_AFTER_DAYS, rebuild_fts: bool = False):
+    """古い行を圧縮し、VACUUM して縮んだ量を表示する。days=None なら圧縮せず VACUUM だけ。
+
+    rebuild_fts は全文検索の索引を作り直す。その間 DB の書き込みロックを握るので Web の利用が少ないときに
+    """
+    print("[maintenance] start")
+    t0 = time.perf_counter()
+    rep = archive_util.maintenance(get_db(), DB_PATH, days, rebuild_fts)
+    for table, (packed, unpacked, before, after) in rep["archived"].items():
+        ratio = f"{after / before:.0%}" if before else "-"
+        print(f"  {table}: archived={packed} restored={unpacked} text {before:,} -> {after:,} bytes ({ratio})")
+    (db0, db1), (f0, f1) = rep["db_bytes"], rep["file_bytes"]
+    print(f"  db   {db0:,} -> {db1:,} bytes (reclaimed {db0 - db1:,})")
+    print(f"  file {f0:,} -> {f1:,} bytes incl. WAL (reclaimed {f0 - f1:,})")
+    for path, size in rep["backups"].items():
+        print(f"  note: backup {path} ({size:,} bytes) is not touched")
+    print(f"[maintenance] end {time.perf_counter() - t0:.1f}s")
 
 # ───────────────────────── CLI 起動
 if __name__ == "__main__":
@@ -551,13 +1557,44 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--fetch-arxiv", action="store_true")
     parser.add_argument("--fetch-feeds", action="store_true")
+    parser.add_argument("--backfill-html", action="store_true", help="保存済み Markdown の HTML を再生成")
+    parser.add_argument("--build-related", action="store_true", help="関連論文索引を作り直す")
+    parser.add_argument("--categories", help="arXiv カテゴリ (カンマ区切り, 例: cs.AI,cs.CL)")
+    parser.add_argument("--enrich", action="store_true", help="未翻訳の論文・記事をエンリッチする")
+    parser.add_argument("--worker", action="store_true", help="エンリッチを定期実行する常駐ワーカー")
+    parser.add_argument("--poll-feeds", action="store_true", help="ワーカーでフィードもソースごとの間隔で取得する")
+    parser.add_argument("--llm-report", type=int, metavar="DAYS", help="直近 DAYS 日の LLM 使用量を集計表示")
+    parser.add_argument("--no-enrich", action="store_true", help="取り込み後のエンリッチを行わない")
+    parser.add_argument("--workers", type=int, default=ARXIV_WORKERS, help="arXiv 取得時の同時実行数")
+    parser.add_argument("--maintenance", action="store_true", help="古い行の圧縮・VACUUM を行い回収量を表示")
+    parser.add_argument("--archive-days", type=int, default=ARCHIVE_AFTER_DAYS,
+                        help="この日数より古いお気に入り以外の行を圧縮 (負数で圧縮しない)")
+    parser.add_argument("--rebuild-fts", action="store_true",
+                        help="maintenance で全文検索の索引も作り直す (その間 DB への書き込みを止める)")
+    parser.add_argument("--serve", action="store_true", help="debug なしのマルチスレッドサーバーで配信する")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--threads", type=int, default=WEB_THREADS, help="ページ表示用のスレッド数")
     args = parser.parse_args()
+    get_db()    # 初回接続時に schema.sql とマイグレーションを適用
 
     if args.fetch_arxiv:
-        fetch_arxiv()
+        fetch_arxiv(args.workers, args.categories.split(",") if args.categories else None, not args.no_enrich)
     elif args.fetch_feeds:
-        fetch_feeds()
+        fetch_feeds(enrich=not args.no_enrich)
+    elif args.enrich:
+        enrich_pending(args.workers)
+    elif args.worker or args.poll_feeds:
+        run_worker(args.workers, poll_feeds=args.poll_feeds)
+    elif args.backfill_html:
+        backfill_html()
+    elif args.build_related:
+        print("[related] rebuilt:", build_related())
+    elif args.llm_report:
+        print_llm_report(args.llm_report)
+    elif args.maintenance:
+        run_maintenance(args.archive_days if args.archive_days >= 0 else None, args.rebuild_fts)
+    elif args.serve:
+        serve(args.host, args.port, args.threads)
     else:
-        if not os.path.exists(DB_PATH):
-            init_db()
-        app.run(debug=True, host="0.0.0.0", port=8000)
+        app.run(debug=True, host=args.host, port=args.port)
@@ -0,0 +1,114 @@
+from __future__ import annotations
+import os, glob, zlib, sqlite3
+
+# 古い行の大きな本文列を zlib 圧縮して DB を小さく保つ (コールド層)。
+#   - 圧縮済みの値は BLOB、未圧縮は TEXT。型で見分けるので混在してよい
+#   - 読み出しは row_factory が自動で展開する。SQL 内では unz(列) で展開する
+#   - FTS は展開ビュー (papers_text / articles_text) を content にしているので検索・スニペットもそのまま
+#   - 圧縮・展開は本文を変えないので FTS のトリガーは発火しない (schema.sql)。外部から圧縮行を
+#     書き換えた場合は maintenance(rebuild_fts=True) で索引を作り直す
+# お気に入りは圧縮しない。あとからお気に入りにした行は次の maintenance で展開し直す。
+COLUMNS = {
+    "papers":   ("abstract_en", "abstract_ja", "analysis_ja", "analysis_html"),
+    "articles": ("summary_en", "summary_ja"),
+}
+LEVEL = 6
+MIN_BYTES = 64   # これより短い値は圧縮しても縮まないので TEXT のまま
+
+def pack(text: str | None):
+    if not text:
+        return text
+    return zlib.compress(text.encode("utf-8"), LEVEL)
+
+def unpack(value):
+    if isinstance(value, bytes):
+        return zlib.decompress(value).decode("utf-8")
+    return value
+
+def row_factory(cursor: sqlite3.Cursor, row: tuple) -> sqlite3.Row:
+    """sqlite3.Row と同じだが、圧縮済みの列を str に戻す"""
+    if bytes in map(type, row):
+        row = tuple(unpack(v) for v in row)
+    return sqlite3.Row(cursor, row)
+
+def register(conn: sqlite3.Connection):
+    conn.create_function("unz", 1, unpack, deterministic=True)
+    conn.row_factory = row_factory
+
+# ───────────────────────── maintenance
+def _size(conn: sqlite3.Connection) -> int:
+    return conn.execute("PRAGMA page_count").fetchone()[0] * conn.execute("PRAGMA page_size").fetchone()[0]
+
+def _files(path: str) -> int:
+    return sum(os.path.getsize(p) for p in (path, path + "-wal") if os.path.exists(p))
+
+def archive(conn: sqlite3.Connection, days: int, batch: int = 500) -> dict:
+    """created_at が days 日より前でお気に入りでない行を圧縮し、お気に入りの圧縮行は展開する。
+
+    返り値は {table: (圧縮した行数, 展開した行数, 圧縮前バイト, 圧縮後バイト)}
+    """
+    out = {}
+    for table, cols in COLUMNS.items():
+        sel = ", ".join(cols)
+        any_text = " OR ".join(f"(typeof({c})='text' AND length(CAST({c} AS BLOB)) >= {MIN_BYTES})" for c in cols)
+        any_blob = " OR ".join(f"typeof({c})='blob'" for c in cols)
+        sets = ", ".join(f"{c}=?" for c in cols)
+        packed = before = after = 0
+        cold = conn.execute(
+            f"""SELECT id FROM {table}
+                 WHERE created_at < datetime('now', ?) AND favorite=0
+                   AND enrich_status='done' AND ({any_text})""",
+            (f"-{days} days",),
+        ).fetchall()
+        for i in range(0, len(cold), batch):
+            ids = [r[0] for r in cold[i : i + batch]]
+            rows = conn.execute(
+                f"SELECT id, {sel} FROM {table} WHERE id IN ({','.join('?' * len(ids))})", ids
+            ).fetchall()
+            updates = []
+            for r in rows:
+                vals, changed = [], False
+                for v in r[1:]:   # row_factory で展開済み
+                    raw = v.encode("utf-8") if v else b""
+                    z = pack(v) if len(raw) >= MIN_BYTES else None
+                    if z is not None and len(z) < len(raw):
+                        before, after, changed = before + len(raw), after + len(z), True
+                        vals.append(z)
+                    else:
+                        vals.append(v)
+                if changed:
+                    updates.append((*vals, r[0]))
+            with conn:
+                conn.executemany(f"UPDATE {table} SET {sets} WHERE id=?", updates)
+            packed += len(updates)
+        favs = conn.execute(f"SELECT id, {sel} FROM {table} WHERE favorite=1 AND ({any_blob})").fetchall()
+        with conn:
+            conn.executemany(f"UPDATE {table} SET {sets} WHERE id=?", [(*r[1:], r[0]) for r in favs])
+        out[table] = (packed, len(favs), before, after)
+    return out
+
+def maintenance(conn: sqlite3.Connection, path: str, days: int | None, rebuild_fts: bool = False) -> dict:
+    """圧縮 (days 指定時) → FTS 最適化 (rebuild_fts なら再構築) → VACUUM → optimize を行い、サイズの変化を返す
+
+    rebuild_fts は展開ビューから索引を作り直し、圧縮行への外部の書き換えを反映する。
+    FTS ごとに 1 トランザクションで書き込みロックを握り続けるので (10 万行で 1 分以上)、
+    その間の Web からの書き込みは busy_timeout を過ぎると "database is locked" で失敗する。
+    """
+    file_before, db_before = _files(path), _size(conn)
+    archived = archive(conn, days) if days is not None else {}
+    for fts in ("papers_fts", "articles_fts"):
+        with conn:
+            if rebuild_fts:
+                conn.execute(f"INSERT INTO {fts}({fts}) VALUES('rebuild')")
+            # 書き換えで増えた FTS のセグメントを 1 つにまとめる
+            conn.execute(f"INSERT INTO {fts}({fts}) VALUES('optimize')")
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    conn.execute("VACUUM")
+    conn.execute("PRAGMA optimize")
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    return {
+        "archived": archived,
+        "db_bytes": (db_before, _size(conn)),
+        "file_bytes": (file_before, _files(path)),
+        "backups": {p: os.path.getsize(p) for p in sorted(glob.glob(path + "*.bak"))},
+    }
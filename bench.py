@@ -0,0 +1,505 @@
+"""オフラインのベンチマーク。OpenAI・外部サイトには一切つながない。
+
+    python bench.py                          # 1k / 100k 行で全シナリオ
+    python bench.py --sizes 1m --scenarios index,paper -n 500
+    python bench.py --json out.json --compare base.json --fail-over 1.2
+    python bench.py --imports                # エントリポイントの import 時間と重い依存の混入チェック
+
+- 合成 DB は BENCH_DIR (既定 .bench/) に行数ごとに作って使い回す
+- FEEDS の全ソースと arXiv API はローカルの HTTP サーバーが固定の RSS / HTML / Atom を返す
+  (ラウンドごとに半分が新規になるので取り込みは毎回「新規 + 既知」の混在になる)
+- openai.chat.completions.create は --llm-delay 秒待って固定の応答を返すスタブに差し替える
+- enrich は取り込み (計測外) で溜めたキューを enrich_pending で空にする時間と、1 件あたりの
+  所要時間・LLM 呼び出し数を測る (翻訳キャッシュと関連論文索引の更新を含む)
+- シナリオごとに子プロセスで実行し、p50 / p99 / スループット / ピーク RSS を報告する
+"""
+from __future__ import annotations
+import os, sys, json, time, random, shutil, argparse, resource, statistics, subprocess, threading
+from datetime import datetime, timedelta, timezone
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from types import SimpleNamespace
+from urllib.parse import urlparse, parse_qs
+from xml.sax.saxutils import escape
+
+BENCH_DIR = os.getenv("BENCH_DIR", ".bench")
+SEED = 42
+SCENARIOS = ["index", "favorites", "paper", "ask", "fetch_feeds", "fetch_arxiv", "enrich"]
+MUTATING = {"ask", "fetch_feeds", "fetch_arxiv", "enrich"}      # DB を書き換えるので毎回コピーして使う
+INGEST = {"fetch_feeds", "fetch_arxiv", "enrich"}                # フィクスチャサーバーを使うシナリオ
+
+WORDS = (
+    "model learning neural network transformer attention language vision training data "
+    "large benchmark reasoning agent diffusion retrieval robust efficient sparse graph "
+    "reinforcement policy reward token context embedding multimodal alignment inference "
+    "quantization distillation scaling generalization evaluation dataset fine-tuning"
+).split()
+JA = list("大規模言語モデルの推論性能を向上させる新しい手法を提案し複数のベンチマークで評価した")
+ANALYSIS_MD = "\n\n".join(
+    f"### {i}. {h}\n" + "これは合成データです。" * 12
+    for i, h in enumerate(["タイトル", "研究の背景", "目的", "方法", "主な結果", "意義", "今後の展望"], 1)
+) + "\n\n### 8. 140字ツイート\n合成データのツイート #AI"
+
+def parse_size(s: str) -> int:
+    s = s.strip().lower()
+    mult = {"k": 1_000, "m": 1_000_000}.get(s[-1:], 1)
+    return int(float(s.rstrip("km")) * mult)
+
+def _sentence(rng: random.Random, n: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(n))
+
+# ───────────────────────── 合成 DB
+def generate_db(path: str, n: int):
+    """papers n 行、articles n/2 行、qa n/100 行の DB を作り、関連論文索引も作る"""
+    os.environ["NEURASCOPE_DB"] = path
+    import app, related_util
+
+    rng = random.Random(SEED)
+    conn = app.get_db()
+    html = app.render_md(ANALYSIS_MD)
+    now = datetime(2025, 6, 1, tzinfo=timezone.utc)
+    per_day = 200
+    cats = ["cs.AI", "cs.CL", "cs.LG", "cs.CV", "stat.ML"]
+
+    def papers():
+        for i in range(n):
+            t = now - timedelta(days=i // per_day, seconds=i % per_day * 60)
+            iso = t.isoformat(timespec="seconds")
+            yield (
+                f"2506.{i:07d}", _sentence(rng, 10).title(), "".join(rng.choice(JA) for _ in range(30)),
+                _sentence(rng, 120), "".join(rng.choice(JA) for _ in range(200)),
+                "Alice Smith, Bob Tanaka", ", ".join(rng.sample(cats, 2)), iso,
+                ANALYSIS_MD, html, app.HTML_VER, "合成データのツイート #AI",
+                f"https://arxiv.org/pdf/2506.{i:07d}", int(rng.random() < 0.01), iso, iso,
+            )
+
+    def articles():
+        sources = list(app.FEEDS.items())
+        for i in range(n // 2):
+            sid, meta = sources[i % len(sources)]
+            t = now - timedelta(minutes=i * 5)
+            yield (
+                _sentence(rng, 8).title(), "".join(rng.choice(JA) for _ in range(25)),
+                f"https://example.com/{sid}/{i}", _sentence(rng, 40), "".join(rng.choice(JA) for _ in range(80)),
+                t.strftime("%a, %d %b %Y %H:%M:%S"), sid, meta["category"], int(rng.random() < 0.01),
+                t.strftime("%Y-%m-%d %H:%M:%S"),
+            )
+
+    t0 = time.perf_counter()
+    with conn:
+        conn.executemany(
+            """INSERT INTO papers (arxiv_id,title_en,title_ja,abstract_en,abstract_ja,authors,categories,
+                                   published_at,analysis_ja,analysis_html,html_ver,tweet_ja,pdf_url,
+                                   favorite,created_at,translated_at)
+               VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)""",
+            papers(),
+        )
+        conn.executemany(
+            """INSERT INTO articles (title_en,title_ja,link,summary_en,summary_ja,published,source_id,
+                                     category,favorite,created_at)
+               VALUES (?,?,?,?,?,?,?,?,?,?)""",
+            articles(),
+        )
+        conn.executemany(
+            "INSERT INTO qa (paper_id,question,answer_md,answer_html,html_ver) VALUES (?,?,?,?,?)",
+            ((rng.randint(1, n), f"質問 {i}", "回答です。", "<p>回答です。</p>", app.HTML_VER)
+             for i in range(max(1, n // 100))),
+        )
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    indexed = related_util.rebuild(app.related_index_path(), conn)
+    print(f"  generated {path}: papers={n} articles={n // 2} related={indexed} "
+          f"({time.perf_counter() - t0:.1f}s)", file=sys.stderr)
+
+def db_for(n: int) -> str:
+    os.makedirs(BENCH_DIR, exist_ok=True)
+    path = os.path.join(BENCH_DIR, f"bench-{n}.db")
+    if not os.path.exists(path + ".ok"):
+        for f in os.listdir(BENCH_DIR):
+            if f.startswith(f"bench-{n}.db"):
+                os.remove(os.path.join(BENCH_DIR, f))
+        subprocess.run([sys.executable, __file__, "--_gen", path, str(n)], check=True)
+        open(path + ".ok", "w").close()
+    return path
+
+def _copy_db(src: str, dst: str):
+    """DB 本体と付随ファイル (-wal, .version, .related.*) をまとめてコピーする"""
+    d = os.path.dirname(src) or "."
+    for f in os.listdir(d):
+        if f.startswith(os.path.basename(dst)):
+            os.remove(os.path.join(d, f))
+    base = os.path.basename(src)
+    for f in os.listdir(d):
+        if f.startswith(base) and not f.endswith(".ok"):
+            shutil.copy(os.path.join(d, f), dst + f[len(base):])
+
+# ───────────────────────── フィクスチャサーバー
+ITEMS_PER_FEED = 30
+ARXIV_BASE, ARXIV_STEP = 500, 100          # arXiv 擬似 API の初期件数とラウンドごとの新着数
+
+def _feed_items(sid: str, rnd: int):
+    # ラウンドごとに半分ずつずらす → 半分が新規、半分が既知
+    start = rnd * ITEMS_PER_FEED // 2
+    return [(f"{sid} item {j} " + " ".join(WORDS[j % len(WORDS):][:6]),
+             f"https://fixture.local/{sid}/{j}?utm_source=rss", f"Summary of {sid} item {j}")
+            for j in range(start, start + ITEMS_PER_FEED)]
+
+def _render_feed(sid: str, meta: dict, rnd: int) -> tuple[str, bytes]:
+    items = _feed_items(sid, rnd)
+    kind = meta.get("scrape")
+    if kind == "gh":
+        body = "".join(f'<article class="Box-row"><h2><a href="/{sid}/{escape(l.split("/")[-1])}">{escape(t)}</a></h2>'
+                       f"<p>{escape(s)}</p></article>" for t, l, s in items)
+    elif kind == "hf":
+        body = "<ul>" + "".join(f'<li class="paper-item"><h3>{escape(t)}</h3>'
+                                f'<a href="/papers/{sid}-{i}">x</a><p>{escape(s)}</p></li>'
+                                for i, (t, l, s) in enumerate(items, rnd * ITEMS_PER_FEED // 2)) + "</ul>"
+    elif kind == "pwc":
+        body = "".join(f'<div class="paper-card"><h1><a href="/paper/{sid}-{i}">{escape(t)}</a></h1>'
+                       f'<p itemprop="description">{escape(s)}</p></div>'
+                       for i, (t, l, s) in enumerate(items, rnd * ITEMS_PER_FEED // 2))
+    elif kind == "batch":
+        body = "".join(f'<article class="post-preview"><h2>{escape(t)}</h2><a href="{escape(l)}">more</a>'
+                       f'<div class="excerpt">{escape(s)}</div></article>' for t, l, s in items)
+    else:
+        body = None
+    if body is not None:
+        return "text/html; charset=utf-8", f"<html><body>{body}</body></html>".encode()
+    rss = "".join(f"<item><title>{escape(t)}</title><link>{escape(l)}</link>"
+                  f"<description>{escape(s)}</description><pubDate>Mon, 02 Jun 2025 10:00:00 GMT</pubDate></item>"
+                  for t, l, s in items)
+    return "application/rss+xml", f'<?xml version="1.0"?><rss version="2.0"><channel><title>{sid}</title>{rss}</channel></rss>'.encode()
+
+def _render_arxiv(query: dict, rnd: int) -> bytes:
+    total = ARXIV_BASE + rnd * ARXIV_STEP
+    start, count = int(query.get("start", ["0"])[0]), int(query.get("max_results", ["100"])[0])
+    t0 = datetime(2025, 6, 1, tzinfo=timezone.utc)
+    entries = []
+    for p in range(start, min(start + count, total)):
+        k = total - p                           # 新しい順
+        ts = (t0 + timedelta(minutes=k)).strftime("%Y-%m-%dT%H:%M:%SZ")
+        entries.append(
+            f"<entry><id>http://arxiv.org/abs/2506.{k:05d}v1</id><updated>{ts}</updated><published>{ts}</published>"
+            f"<title>Fixture paper {k} {' '.join(WORDS[k % len(WORDS):][:5])}</title>"
+            f"<summary>{' '.join(WORDS) * 3}</summary><author><name>Fixture Author</name></author>"
+            f'<link href="http://arxiv.org/abs/2506.{k:05d}v1" rel="alternate" type="text/html"/>'
+            f'<link title="pdf" href="http://arxiv.org/pdf/2506.{k:05d}v1" rel="related" type="application/pdf"/>'
+            f'<arxiv:primary_category term="cs.AI"/><category term="cs.AI"/></entry>'
+        )
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?><feed xmlns="http://www.w3.org/2005/Atom" '
+        'xmlns:opensearch="http://a9.com/-/spec/opensearch/1.1/" xmlns:arxiv="http://arxiv.org/schemas/atom">'
+        f"<opensearch:totalResults>{total}</opensearch:totalResults>"
+        f"<opensearch:startIndex>{start}</opensearch:startIndex>"
+        f"<opensearch:itemsPerPage>{count}</opensearch:itemsPerPage>" + "".join(entries) + "</feed>"
+    ).encode()
+
+class FixtureServer(ThreadingHTTPServer):
+    daemon_threads = True
+    rnd = 0
+
+    def __init__(self, feeds: dict):
+        super().__init__(("127.0.0.1", 0), _FixtureHandler)
+        self.feeds = feeds
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    @property
+    def base(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+class _FixtureHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        u = urlparse(self.path)
+        srv = self.server
+        if u.path.startswith("/feed/") and u.path[6:] in srv.feeds:
+            ctype, body = _render_feed(u.path[6:], srv.feeds[u.path[6:]], srv.rnd)
+        elif u.path == "/arxiv/query":
+            ctype, body = "application/atom+xml", _render_arxiv(parse_qs(u.query), srv.rnd)
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", ctype)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *a):
+        pass
+
+# ───────────────────────── LLM スタブ
+LLM_CALLS = [0]       # スタブが受けた呼び出し数
+_llm_calls_lock = threading.Lock()
+
+def install_llm_stub(delay: float):
+    """openai.chat.completions.create を delay 秒後に固定応答を返す関数に置き換える"""
+    os.environ.setdefault("OPENAI_API_KEY", "bench")
+    import openai
+
+    usage = SimpleNamespace(prompt_tokens=500, completion_tokens=300)
+
+    def create(model, messages, stream=False, response_format=None, **kw):
+        with _llm_calls_lock:
+            LLM_CALLS[0] += 1
+        time.sleep(delay)
+        if response_format:
+            text = json.dumps({k: "訳: " + v for k, v in json.loads(messages[-1]["content"]).items()},
+                              ensure_ascii=False)
+        elif len(messages) == 3:
+            text = ANALYSIS_MD
+        else:
+            text = "合成の回答です。\n\n- 項目 1\n- 項目 2"
+        if not stream:
+            return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=text))], usage=usage)
+
+        class _Stream:
+            def __iter__(self):
+                for i in range(0, len(text), 8):
+                    yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=text[i:i + 8]))],
+                                          usage=None)
+                yield SimpleNamespace(choices=[], usage=usage)
+
+            def close(self):
+                pass
+
+        return _Stream()
+
+    openai.chat.completions.create = create
+
+# ───────────────────────── シナリオ (子プロセス)
+def run_scenario(spec: dict) -> dict:
+    os.environ["NEURASCOPE_DB"] = spec["db"]
+    install_llm_stub(spec["llm_delay"])
+    import arxiv, app
+
+    rng = random.Random(SEED)
+    n_papers = app.get_db().execute("SELECT MAX(id) FROM papers").fetchone()[0] or 1
+    name, lat, extra = spec["scenario"], [], {}
+
+    if name in INGEST:
+        srv = FixtureServer(app.FEEDS)
+        app.FEEDS = {sid: {**meta, "url": f"{srv.base}/feed/{sid}"} for sid, meta in app.FEEDS.items()}
+
+        class _LocalClient(arxiv.Client):
+            query_url_format = srv.base + "/arxiv/query?{}"
+
+            def __init__(self, page_size: int = 100, delay_seconds: float = 0, num_retries: int = 0):
+                super().__init__(page_size=page_size, delay_seconds=delay_seconds, num_retries=num_retries)
+
+        arxiv.Client = _LocalClient
+        run = (lambda: app.fetch_feeds(enrich=False)) if name == "fetch_feeds" else (lambda: app.fetch_arxiv(enrich=False))
+        sink = open(os.devnull, "w")
+        conn = app.get_db()
+
+        def queued() -> int:
+            return conn.execute(
+                """SELECT (SELECT COUNT(*) FROM papers WHERE enrich_status IN ('pending','running'))
+                        + (SELECT COUNT(*) FROM articles WHERE enrich_status IN ('pending','running'))"""
+            ).fetchone()[0]
+
+        items = calls = 0
+        wall = 0.0
+        for rnd in range(spec["rounds"]):
+            srv.rnd = rnd
+            stdout, sys.stdout = sys.stdout, sink     # 取り込みの print は計測から外す
+            try:
+                if name == "enrich":
+                    app.fetch_arxiv(enrich=False)
+                    app.fetch_feeds(enrich=False)
+                    before, calls0 = queued(), LLM_CALLS[0]
+                    run = lambda: app.enrich_pending(app.ARXIV_WORKERS)
+                t0 = time.perf_counter()
+                run()
+                lat.append(time.perf_counter() - t0)
+            finally:
+                sys.stdout = stdout
+            wall += lat[-1]
+            if name == "enrich":
+                items += before - queued()
+                calls += LLM_CALLS[0] - calls0
+        srv.shutdown()
+        if name == "enrich":
+            extra = {
+                "items": items,
+                "ms_per_item": round(wall * 1000 / max(items, 1), 2),
+                "llm_calls_per_item": round(calls / max(items, 1), 2),
+            }
+    else:
+        def request(client):
+            if name == "index":
+                r = client.get("/")
+            elif name == "favorites":
+                r = client.get("/favorites")
+            elif name == "paper":
+                r = client.get(f"/paper/{rng.randint(1, n_papers)}")
+            else:
+                r = client.post("/api/ask", json={"paper_id": rng.randint(1, n_papers),
+                                                  "question": "この論文の新規性は？", "force_refresh": True})
+            assert r.status_code == 200, (name, r.status_code)
+
+        client = app.app.test_client()
+        for _ in range(spec["warmup"]):
+            request(client)
+        per_thread = max(1, spec["requests"] // spec["concurrency"])
+        lock = threading.Lock()
+
+        def worker():
+            c, mine = app.app.test_client(), []
+            for _ in range(per_thread):
+                t0 = time.perf_counter()
+                request(c)
+                mine.append(time.perf_counter() - t0)
+            with lock:
+                lat.extend(mine)
+
+        threads = [threading.Thread(target=worker) for _ in range(spec["concurrency"])]
+        t_all = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        wall = time.perf_counter() - t_all
+
+    lat.sort()
+    return {
+        "scenario": name,
+        "rows": spec["rows"],
+        "count": len(lat),
+        "p50_ms": round(statistics.median(lat) * 1000, 2),
+        "p99_ms": round(lat[min(len(lat) - 1, int(len(lat) * 0.99))] * 1000, 2),
+        "throughput": round(len(lat) / wall, 2),
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        **extra,
+    }
+
+# ───────────────────────── 起動時間 (import)
+# エントリポイントごとの import 文と、そこで読み込まれてはいけない重い依存
+HEAVY = {"openai", "arxiv", "feedparser", "requests", "bs4", "numpy", "backoff", "apscheduler", "waitress"}
+IMPORT_ENTRIES = {
+    "import_app":  ("import app", HEAVY),                        # Web ワーカー・cron 共通
+    "import_main": ("import main; main.build_parser()", HEAVY | {"flask", "markdown"}),
+}
+
+_IMPORT_CHILD = """
+import sys, json, time, resource
+t0 = time.perf_counter()
+{stmt}
+ms = (time.perf_counter() - t0) * 1000
+print(json.dumps({{"ms": ms, "loaded": sorted(m for m in {heavy!r} if m in sys.modules),
+                  "rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}}))
+"""
+
+def bench_imports(runs: int) -> tuple[list[dict], list[str]]:
+    """エントリポイントを毎回新しいプロセスで import し、所要時間と読み込まれた重い依存を返す"""
+    results, leaks = [], []
+    here = os.path.dirname(os.path.abspath(__file__))
+    for name, (stmt, heavy) in IMPORT_ENTRIES.items():
+        code = _IMPORT_CHILD.format(stmt=stmt, heavy=sorted(heavy))
+        samples = []
+        for i in range(runs + 1):     # 1 回目は .pyc 生成を含むので捨てる
+            out = subprocess.run([sys.executable, "-c", code], cwd=here, capture_output=True, text=True)
+            if out.returncode:
+                raise RuntimeError(f"{name} failed\n{out.stderr[-2000:]}")
+            if i:
+                samples.append(json.loads(out.stdout.strip().splitlines()[-1]))
+        lat = sorted(r["ms"] for r in samples)
+        loaded = samples[-1]["loaded"]
+        if loaded:
+            leaks.append(f"{name}: {', '.join(loaded)}")
+        results.append({
+            "scenario": name,
+            "rows": 0,
+            "count": len(lat),
+            "p50_ms": round(statistics.median(lat), 2),
+            "p99_ms": round(lat[min(len(lat) - 1, int(len(lat) * 0.99))], 2),
+            "throughput": round(1000 / statistics.median(lat), 2),
+            "peak_rss_mb": round(max(r["rss"] for r in samples), 1),
+        })
+        print(f"  {name}: p50={results[-1]['p50_ms']}ms heavy={loaded or '-'}", file=sys.stderr)
+    return results, leaks
+
+# ───────────────────────── 集計
+def _print_table(results: list[dict], baseline: dict | None):
+    print(f"{'rows':>8} {'scenario':<12} {'n':>5} {'p50 ms':>9} {'p99 ms':>9} {'ops/s':>9} {'rss MB':>8}"
+          + ("  p50 vs base" if baseline else ""))
+    for r in results:
+        line = (f"{r['rows']:>8} {r['scenario']:<12} {r['count']:>5} {r['p50_ms']:>9} {r['p99_ms']:>9} "
+                f"{r['throughput']:>9} {r['peak_rss_mb']:>8}")
+        b = (baseline or {}).get((r["rows"], r["scenario"]))
+        if b:
+            line += f"  x{r['p50_ms'] / b['p50_ms']:.2f}"
+        if "items" in r:
+            line += f"  items={r['items']} {r['ms_per_item']}ms/item {r['llm_calls_per_item']} llm/item"
+        print(line)
+
+def main():
+    ap = argparse.ArgumentParser(description="NeuraScope オフラインベンチマーク")
+    ap.add_argument("--sizes", default="1k,100k", help="合成 DB の論文数 (例: 1k,100k,1m)")
+    ap.add_argument("--scenarios", default=",".join(SCENARIOS))
+    ap.add_argument("-n", "--requests", type=int, default=200, help="HTTP シナリオのリクエスト数")
+    ap.add_argument("--ask-requests", type=int, default=20, help="/api/ask のリクエスト数")
+    ap.add_argument("--rounds", type=int, default=5, help="取り込み・エンリッチシナリオの実行回数")
+    ap.add_argument("--warmup", type=int, default=3)
+    ap.add_argument("--concurrency", type=int, default=1)
+    ap.add_argument("--llm-delay", type=float, default=0.2, help="LLM スタブの応答遅延 (秒)")
+    ap.add_argument("--imports", action="store_true", help="DB シナリオの代わりに import 時間を測る")
+    ap.add_argument("--import-runs", type=int, default=10, help="--imports の計測回数")
+    ap.add_argument("--json", help="結果を JSON で保存")
+    ap.add_argument("--compare", help="比較対象の JSON (以前の --json の出力)")
+    ap.add_argument("--fail-over", type=float, help="p50 が比較対象のこの倍率を超えたら終了コード 1")
+    ap.add_argument("--_gen", nargs=2, help=argparse.SUPPRESS)
+    ap.add_argument("--_child", help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args._gen:
+        generate_db(args._gen[0], int(args._gen[1]))
+        return
+    if args._child:
+        print(json.dumps(run_scenario(json.loads(args._child))))
+        return
+
+    results, leaks = [], []
+    if args.imports:
+        results, leaks = bench_imports(args.import_runs)
+    for size in ([] if args.imports else args.sizes.split(",")):
+        rows = parse_size(size)
+        src = db_for(rows)
+        for name in args.scenarios.split(","):
+            db = src
+            if name in MUTATING:
+                db = os.path.join(BENCH_DIR, f"work-{rows}.db")
+                _copy_db(src, db)
+            spec = dict(scenario=name, db=db, rows=rows, rounds=args.rounds, warmup=args.warmup,
+                        requests=args.ask_requests if name == "ask" else args.requests,
+                        concurrency=args.concurrency if name not in INGEST else 1,
+                        llm_delay=args.llm_delay)
+            out = subprocess.run([sys.executable, __file__, "--_child", json.dumps(spec)],
+                                 capture_output=True, text=True)
+            if out.returncode:
+                print(f"  {name} @ {rows}: failed\n{out.stderr[-2000:]}", file=sys.stderr)
+                continue
+            results.append(json.loads(out.stdout.strip().splitlines()[-1]))
+            print(f"  {name} @ {rows}: p50={results[-1]['p50_ms']}ms", file=sys.stderr)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = {(r["rows"], r["scenario"]): r for r in json.load(f)["results"]}
+    _print_table(results, baseline)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"created_at": datetime.now().isoformat(timespec="seconds"),
+                       "llm_delay": args.llm_delay, "results": results}, f, indent=2)
+    for leak in leaks:
+        print(f"REGRESSION: heavy import at startup: {leak}", file=sys.stderr)
+    worse = []
+    if baseline and args.fail_over:
+        worse = [r for r in results if (r["rows"], r["scenario"]) in baseline
+                 and r["p50_ms"] > baseline[(r["rows"], r["scenario"])]["p50_ms"] * args.fail_over]
+        for r in worse:
+            print(f"REGRESSION: {r['scenario']} @ {r['rows']}", file=sys.stderr)
+    if leaks or worse:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+from __future__ import annotations
+import sqlite3
+
+CHUNK = 500   # 1 トランザクション / IN 句あたりの行数 (SQLite の変数上限にも収まる)
+
+def existing_keys(conn: sqlite3.Connection, table: str, key: str, values) -> set:
+    """values のうち table に既に存在するキーを IN 句でまとめて調べる"""
+    values = list(dict.fromkeys(values))
+    found = set()
+    for i in range(0, len(values), CHUNK):
+        chunk = values[i : i + CHUNK]
+        found.update(
+            r[0]
+            for r in conn.execute(
+                f"SELECT {key} FROM {table} WHERE {key} IN ({','.join('?' * len(chunk))})", chunk
+            )
+        )
+    return found
+
+class BulkWriter:
+    """行を溜めてキーで重複排除し、チャンクごとに executemany + UPSERT で書き込む。
+
+    update を指定するとキー衝突時にその列を上書き (値が変わった行のみ)、
+    空なら ON CONFLICT DO NOTHING で既存行はそのまま残す。
+    """
+
+    def __init__(self, table: str, columns: list[str], key: str,
+                 update: list[str] | tuple = (), chunk: int = CHUNK):
+        self.table, self.columns, self.key = table, list(columns), key
+        self.update, self.chunk = list(update), chunk
+        self.rows: dict = {}
+        self.duplicates = 0
+
+    def add(self, row: dict) -> bool:
+        """同じキーが既に溜まっていれば最初の行を残して False を返す"""
+        k = row[self.key]
+        if k in self.rows:
+            self.duplicates += 1
+            return False
+        self.rows[k] = tuple(row.get(c) for c in self.columns)
+        return True
+
+    def __len__(self):
+        return len(self.rows)
+
+    def _sql(self) -> str:
+        cols = ",".join(self.columns)
+        marks = ",".join("?" * len(self.columns))
+        sql = f"INSERT INTO {self.table} ({cols}) VALUES ({marks}) ON CONFLICT({self.key}) "
+        if not self.update:
+            return sql + "DO NOTHING"
+        sets = ",".join(f"{c}=excluded.{c}" for c in self.update)
+        changed = " OR ".join(f"{c} IS NOT excluded.{c}" for c in self.update)
+        return sql + f"DO UPDATE SET {sets} WHERE {changed}"
+
+    def flush(self, conn: sqlite3.Connection) -> dict:
+        """溜めた行をチャンク単位のトランザクションで書き込み、件数を返す"""
+        counts = {"new": 0, "updated": 0, "skipped": self.duplicates}
+        sql, items = self._sql(), list(self.rows.items())
+        for i in range(0, len(items), self.chunk):
+            chunk = items[i : i + self.chunk]
+            known = existing_keys(conn, self.table, self.key, [k for k, _ in chunk]) if self.update else set()
+            with conn:
+                changed = conn.executemany(sql, [row for _, row in chunk]).rowcount
+            # DO NOTHING なら rowcount は挿入数、DO UPDATE なら挿入数 + 更新数
+            new = changed if not self.update else len(chunk) - len(known)
+            counts["new"] += new
+            counts["updated"] += changed - new
+            counts["skipped"] += len(chunk) - changed
+        self.rows.clear()
+        self.duplicates = 0
+        return counts
@@ -9,7 +9,7 @@ FEEDS = {
     },
     "pwc_trend": {
         "name": "Papers with Code - Trending",
-        "url":  "https://paperswithcode.com",
+        "url":  "https://paperswithcode.com/trending",
         "category": "paper",
         "scrape": "pwc",
     },
@@ -36,3 +36,33 @@ FEEDS = {
     "lil_log":    { "name":"Lil'Log",                "url":"https://lilianweng.github.io/index.xml",      "category":"blog"},
     "nlp_news":   { "name":"NLP Newsletter",         "url":"https://nlpnewsletter.substack.com/feed",      "category":"news"},
 }
+
+# feeds.py の "scrape" キーが指す HTML スクレイパー定義（書式は scrape_util を参照）
+SCRAPERS = {
+    "gh": {
+        "item": "article.Box-row",
+        "title": "h3 > a, h2 > a",
+        "sep": " ",
+        "summary": "p",
+        "base": "https://github.com",
+    },
+    "hf": {
+        "item": "li.paper-item",
+        "title": ["h4", "h3"],
+        "link": "a[href*='/papers/']",
+        "summary": "p",
+        "base": "https://huggingface.co",
+    },
+    "pwc": {
+        "item": "div.paper-card",
+        "title": "h1 a",
+        "summary": "p[itemprop='description']",
+        "base": "https://paperswithcode.com",
+    },
+    "batch": {
+        "item": "article.post-preview, div.post-block",
+        "title": ["h3", "h2"],
+        "link": "a[href]",
+        "summary": ["div.excerpt", "p"],
+    },
+}
@@ -0,0 +1,215 @@
+from __future__ import annotations
+import os, time, sqlite3, functools, threading, contextlib
+import metrics_util
+
+# 全 LLM 呼び出しの共通レイヤー: 入力トークン数の計測と上限での切り詰め、
+# 呼び出しごとのトークン数・レイテンシを llm_calls テーブルへ記録する。
+USAGE_DB = os.getenv("NEURASCOPE_DB", "neurascope.db")
+INPUT_BUDGET = int(os.getenv("LLM_INPUT_BUDGET", "6000"))   # 1 メッセージあたりの入力トークン上限
+MAX_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", "8"))     # プロセス内で同時に投げる LLM リクエストの上限
+
+@functools.cache
+def _openai():
+    """openai は読み込みに数百 ms かかるので、最初の呼び出しまで import しない"""
+    import openai
+
+    openai.api_key = os.getenv("OPENAI_API_KEY") or openai.api_key
+    return openai
+
+def retry(max_tries: int, **kw):
+    """OpenAIError を指数バックオフで再試行するデコレータ (backoff / openai も遅延 import)"""
+    def deco(fn):
+        @functools.cache
+        def wrapped():
+            import backoff
+
+            return backoff.on_exception(backoff.expo, _openai().OpenAIError, max_tries=max_tries, **kw)(fn)
+
+        @functools.wraps(fn)
+        def call(*args, **kwargs):
+            return wrapped()(*args, **kwargs)
+        return call
+    return deco
+
+@functools.cache
+def _encoding(model: str):
+    """tiktoken のエンコーディング。BPE ファイルを取得できない環境では None"""
+    import tiktoken
+
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("o200k_base")
+    except Exception as exc:  # noqa: BLE001
+        print("[llm_util] tiktoken unavailable, using estimate:", exc)
+        return None
+
+def count_tokens(text: str, model: str) -> int:
+    enc = _encoding(model)
+    if enc is not None:
+        return len(enc.encode(text or "", disallowed_special=()))
+    # 概算: ASCII は 4 文字で 1 トークン、日本語などは 1 文字 1 トークン
+    ascii_n = sum(1 for ch in text or "" if ord(ch) < 128)
+    return ascii_n // 4 + (len(text or "") - ascii_n) + 1
+
+def count_messages(msgs: list[dict], model: str) -> int:
+    return sum(count_tokens(m["content"], model) + 4 for m in msgs) + 2
+
+def truncate(text: str, max_tokens: int, model: str) -> str:
+    """max_tokens を超える部分を末尾から切り落とす"""
+    if not text or count_tokens(text, model) <= max_tokens:
+        return text
+    enc = _encoding(model)
+    if enc is not None:
+        return enc.decode(enc.encode(text, disallowed_special=())[:max_tokens]) + "…"
+    lo, hi = 0, len(text)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if count_tokens(text[:mid], model) <= max_tokens:
+            lo = mid
+        else:
+            hi = mid - 1
+    return text[:lo] + "…"
+
+def _fit(msgs: list[dict], model: str, budget: int | None) -> list[dict]:
+    if not budget:
+        return msgs
+    return [
+        {**m, "content": truncate(m["content"], budget, model)} if m["role"] == "user" else m
+        for m in msgs
+    ]
+
+# ───────────────────────── 記録
+_local = threading.local()
+
+def _usage_db() -> sqlite3.Connection:
+    """スレッドごとに使い回す記録用接続。テーブルは schema.sql で作る (app.init_db)"""
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = _local.conn = sqlite3.connect(USAGE_DB, timeout=30, check_same_thread=False)
+        conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+def record(func: str, model: str, prompt_tokens: int, completion_tokens: int, latency: float, ok: bool):
+    metrics_util.LLM_SECONDS.observe(latency, func=func, model=model)
+    metrics_util.LLM_TOKENS.inc(prompt_tokens or 0, func=func, kind="prompt")
+    metrics_util.LLM_TOKENS.inc(completion_tokens or 0, func=func, kind="completion")
+    if not ok:
+        metrics_util.LLM_ERRORS.inc(func=func, model=model)
+    try:
+        with _usage_db() as conn:
+            conn.execute(
+                """INSERT INTO llm_calls (func,model,prompt_tokens,completion_tokens,latency_ms,ok)
+                   VALUES (?,?,?,?,?,?)""",
+                (func, model, prompt_tokens, completion_tokens, int(latency * 1000), int(ok)),
+            )
+    except sqlite3.Error as exc:
+        print("[llm_util] usage write failed:", exc)
+
+def report(days: int = 7) -> list[dict]:
+    """関数 × 日ごとの呼び出し数・トークン数・レイテンシを集計する"""
+    with _usage_db() as conn:
+        rows = conn.execute(
+            """SELECT substr(created_at,1,10) AS day, func,
+                      COUNT(*) AS calls, SUM(1-ok) AS errors,
+                      SUM(prompt_tokens) AS prompt_tokens,
+                      SUM(completion_tokens) AS completion_tokens,
+                      CAST(AVG(latency_ms) AS INTEGER) AS avg_latency_ms,
+                      MAX(latency_ms) AS max_latency_ms
+                 FROM llm_calls
+                WHERE created_at >= datetime('now', ?)
+             GROUP BY day, func
+             ORDER BY day DESC, func""",
+            (f"-{days} days",),
+        ).fetchall()
+    cols = ["day", "func", "calls", "errors", "prompt_tokens", "completion_tokens",
+            "avg_latency_ms", "max_latency_ms"]
+    return [dict(zip(cols, r)) for r in rows]
+
+# ───────────────────────── 同時実行枠
+class Busy(RuntimeError):
+    """同時実行枠が wait 秒以内に空かなかった"""
+
+_slots = threading.BoundedSemaphore(MAX_CONCURRENCY)
+_in_flight = 0
+_in_flight_lock = threading.Lock()
+
+@contextlib.contextmanager
+def _slot(func: str, wait: float | None):
+    """LLM 1 リクエスト分の枠を取る。wait=None なら空くまで待つ (バッチ用)"""
+    global _in_flight
+    if not _slots.acquire(timeout=-1 if wait is None else wait):
+        metrics_util.LLM_REJECTED.inc(func=func)
+        raise Busy(f"LLM concurrency limit ({MAX_CONCURRENCY}) reached")
+    with _in_flight_lock:
+        _in_flight += 1
+    try:
+        yield
+    finally:
+        with _in_flight_lock:
+            _in_flight -= 1
+        _slots.release()
+
+def in_flight() -> int:
+    return _in_flight
+
+# ───────────────────────── 呼び出し
+def chat(func: str, msgs: list[dict], *, model: str, budget: int | None = INPUT_BUDGET,
+         wait: float | None = None, **kw) -> str:
+    """chat.completions を呼び、使用量を記録して本文を返す。例外はそのまま送出する
+
+    同時実行は MAX_CONCURRENCY 本まで。wait 秒で枠が取れなければ Busy を送出する。
+    """
+    msgs = _fit(msgs, model, budget)
+    prompt = count_messages(msgs, model)
+    with _slot(func, wait):
+        t0 = time.perf_counter()
+        try:
+            res = _openai().chat.completions.create(model=model, messages=msgs, **kw)
+        except Exception:
+            record(func, model, prompt, 0, time.perf_counter() - t0, False)
+            raise
+    text = res.choices[0].message.content.strip()
+    usage = getattr(res, "usage", None)
+    record(
+        func, model,
+        getattr(usage, "prompt_tokens", None) or prompt,
+        getattr(usage, "completion_tokens", None) or count_tokens(text, model),
+        time.perf_counter() - t0, True,
+    )
+    return text
+
+def chat_stream(func: str, msgs: list[dict], *, model: str, budget: int | None = INPUT_BUDGET,
+                wait: float | None = None, **kw):
+    """ストリーミング版。テキスト差分を yield し、終了 (中断含む) 時に使用量を記録する。
+
+    枠はストリームを読み終える (または閉じる) まで保持する。
+    """
+    msgs = _fit(msgs, model, budget)
+    prompt = count_messages(msgs, model)
+    with _slot(func, wait):
+        t0 = time.perf_counter()
+        try:
+            upstream = _openai().chat.completions.create(
+                model=model, messages=msgs, stream=True, stream_options={"include_usage": True}, **kw
+            )
+        except Exception:
+            record(func, model, prompt, 0, time.perf_counter() - t0, False)
+            raise
+        parts, usage, ok = [], None, False
+        try:
+            for chunk in upstream:
+                usage = getattr(chunk, "usage", None) or usage   # 最後のチャンクにだけ入る
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    parts.append(delta)
+                    yield delta
+            ok = True
+        finally:
+            upstream.close()   # 切断 (GeneratorExit) 時も上流のリクエストを止める
+            record(
+                func, model,
+                getattr(usage, "prompt_tokens", None) or prompt,
+                getattr(usage, "completion_tokens", None) or count_tokens("".join(parts), model),
+                time.perf_counter() - t0, ok,
+            )
@@ -1,5 +1,121 @@
-def main():
-    print("Hello from neurascope!")
+"""NeuraScope のエントリポイント。
+
+    python main.py serve [--host 0.0.0.0] [--port 8000] [--threads 8] [--debug]
+    python main.py fetch-arxiv [--categories cs.AI,cs.CL] [--workers 4] [--no-enrich]
+    python main.py fetch-feeds [--no-enrich]
+    python main.py enrich [--workers 4]
+    python main.py worker [--poll-feeds] [--workers 4]
+    python main.py maintenance [--archive-days 90 | --no-archive] [--rebuild-fts]
+    python main.py backfill-html | build-related | llm-report DAYS
+
+app は各サブコマンドの中で import する (`--help` は依存ライブラリを読み込まない)。
+重い依存 (openai / arxiv / feedparser / bs4 / numpy ...) は app 側でも使う関数の中でだけ
+import するので、cron の取り込みは Web 用のモジュールを、Web ワーカーは取り込み用の
+モジュールを読み込まない。起動時間は `python bench.py --imports` で確認する。
+`python app.py --fetch-arxiv` などの従来のフラグもそのまま使える。
+"""
+from __future__ import annotations
+import argparse
+
+def _app():
+    import app
+
+    app.get_db()    # 初回接続時に schema.sql とマイグレーションを適用
+    return app
+
+def cmd_serve(args):
+    app = _app()
+    if args.debug:
+        app.app.run(debug=True, host=args.host, port=args.port)
+    else:
+        app.serve(args.host, args.port, args.threads if args.threads is not None else app.WEB_THREADS)
+
+def cmd_fetch_arxiv(args):
+    app = _app()
+    app.fetch_arxiv(
+        args.workers if args.workers is not None else app.ARXIV_WORKERS,
+        args.categories.split(",") if args.categories else None,
+        not args.no_enrich,
+    )
+
+def cmd_fetch_feeds(args):
+    _app().fetch_feeds(enrich=not args.no_enrich)
+
+def cmd_enrich(args):
+    app = _app()
+    app.enrich_pending(args.workers if args.workers is not None else app.ARXIV_WORKERS)
+
+def cmd_worker(args):
+    app = _app()
+    app.run_worker(args.workers if args.workers is not None else app.ARXIV_WORKERS, poll_feeds=args.poll_feeds)
+
+def cmd_maintenance(args):
+    app = _app()
+    if args.no_archive:
+        app.run_maintenance(None, args.rebuild_fts)
+    else:
+        app.run_maintenance(args.archive_days if args.archive_days is not None else app.ARCHIVE_AFTER_DAYS, args.rebuild_fts)
+
+def cmd_backfill_html(args):
+    _app().backfill_html()
+
+def cmd_build_related(args):
+    print("[related] rebuilt:", _app().build_related())
+
+def cmd_llm_report(args):
+    _app().print_llm_report(args.days)
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="neurascope", description="NeuraScope")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("serve", help="Web サーバー (既定は debug なしのマルチスレッド)")
+    p.add_argument("--host", default="0.0.0.0")
+    p.add_argument("--port", type=int, default=8000)
+    p.add_argument("--threads", type=int, help="ページ表示用のスレッド数 (既定 WEB_THREADS)")
+    p.add_argument("--debug", action="store_true", help="Flask の開発サーバーで起動する")
+    p.set_defaults(func=cmd_serve)
+
+    p = sub.add_parser("fetch-arxiv", help="arXiv の新着を取り込む")
+    p.add_argument("--categories", help="arXiv カテゴリ (カンマ区切り, 例: cs.AI,cs.CL)")
+    p.add_argument("--workers", type=int, help="同時実行数 (既定 ARXIV_WORKERS)")
+    p.add_argument("--no-enrich", action="store_true", help="取り込み後のエンリッチを行わない")
+    p.set_defaults(func=cmd_fetch_arxiv)
+
+    p = sub.add_parser("fetch-feeds", help="外部フィードをすべて取り込む")
+    p.add_argument("--no-enrich", action="store_true", help="取り込み後のエンリッチを行わない")
+    p.set_defaults(func=cmd_fetch_feeds)
+
+    p = sub.add_parser("enrich", help="未翻訳の論文・記事をエンリッチする")
+    p.add_argument("--workers", type=int)
+    p.set_defaults(func=cmd_enrich)
+
+    p = sub.add_parser("worker", help="エンリッチを定期実行する常駐ワーカー")
+    p.add_argument("--poll-feeds", action="store_true", help="フィードもソースごとの間隔で取得する")
+    p.add_argument("--workers", type=int)
+    p.set_defaults(func=cmd_worker)
+
+    p = sub.add_parser("maintenance", help="古い行の圧縮・VACUUM を行い回収量を表示")
+    p.add_argument("--archive-days", type=int, help="この日数より古いお気に入り以外の行を圧縮 (既定 ARCHIVE_AFTER_DAYS)")
+    p.add_argument("--no-archive", action="store_true", help="圧縮せず VACUUM だけ行う")
+    p.add_argument("--rebuild-fts", action="store_true",
+                   help="全文検索の索引も作り直す (10 万行で 1 分以上 DB への書き込みを止める)")
+    p.set_defaults(func=cmd_maintenance)
+
+    p = sub.add_parser("backfill-html", help="保存済み Markdown の HTML を再生成")
+    p.set_defaults(func=cmd_backfill_html)
+
+    p = sub.add_parser("build-related", help="関連論文索引を作り直す")
+    p.set_defaults(func=cmd_build_related)
+
+    p = sub.add_parser("llm-report", help="直近 DAYS 日の LLM 使用量を集計表示")
+    p.add_argument("days", type=int)
+    p.set_defaults(func=cmd_llm_report)
+    return parser
+
+def main(argv: list[str] | None = None):
+    args = build_parser().parse_args(argv)
+    args.func(args)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,114 @@
+from __future__ import annotations
+import time, bisect, threading, contextlib
+
+# Prometheus テキスト形式のメトリクス (依存ライブラリなし)。
+# 値はプロセス内に溜めるだけなので、別プロセスのバッチ (取り込み等) は DB 経由で出す。
+LATENCY_BUCKETS = (.001, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+LLM_BUCKETS = (.25, .5, 1, 2, 4, 8, 16, 32, 64)
+
+_registry: list["_Metric"] = []
+
+def _esc(v) -> str:
+    return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", " ")
+
+def _labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{k}="{_esc(v)}"' for k, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, doc: str, labels: tuple = ()):
+        self.name, self.doc, self.labelnames = name, doc, tuple(labels)
+        self._lock = threading.Lock()
+        self._values: dict[tuple, object] = {}
+        _registry.append(self)
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(labels.get(k, "") for k in self.labelnames)
+
+    def render(self) -> list[str]:
+        out = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, v in items:
+            out += self._lines(key, v)
+        return out
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, n: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + n
+
+    def _lines(self, key, v):
+        return [f"{self.name}{_labels(self.labelnames, key)} {v}"]
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, doc: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        super().__init__(name, doc, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, seconds: float, **labels):
+        key = self._key(labels)
+        i = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            v = self._values.get(key)
+            if v is None:
+                v = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            v[0][i] += 1
+            v[1] += seconds
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - t0, **labels)
+
+    def _lines(self, key, v):
+        counts, total = v
+        lines, acc = [], 0
+        for b, n in zip(self.buckets + (float("inf"),), counts):
+            acc += n
+            le = 'le="+Inf"' if b == float("inf") else f'le="{b}"'
+            lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {acc}")
+        lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {total:.6f}")
+        lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {acc}")
+        return lines
+
+def gauge_lines(name: str, doc: str, labelnames: tuple, rows) -> list[str]:
+    """収集時に計算する gauge。rows は (ラベル値タプル, 値) の列"""
+    out = [f"# HELP {name} {doc}", f"# TYPE {name} gauge"]
+    out += [f"{name}{_labels(labelnames, key)} {value}" for key, value in rows]
+    return out
+
+def render(extra: list[str] = ()) -> str:
+    lines = [line for m in _registry for line in m.render()]
+    return "\n".join(lines + list(extra)) + "\n"
+
+# ───────────────────────── 共通メトリクス
+HTTP_SECONDS = Histogram(
+    "neurascope_http_request_seconds", "Flask route latency.", ("route", "method", "status"))
+SQL_SECONDS = Histogram(
+    "neurascope_sqlite_query_seconds", "SQLite statement execution time (excluding row fetch).", ("op",))
+OUTBOUND_SECONDS = Histogram(
+    "neurascope_outbound_request_seconds", "Outbound HTTP fetch time per source.", ("source", "status"),
+    buckets=(.05, .1, .25, .5, 1, 2.5, 5, 10, 20, 40))
+SCRAPE_SECONDS = Histogram(
+    "neurascope_scrape_seconds", "HTML scraper parse time.", ("scraper",))
+LLM_SECONDS = Histogram(
+    "neurascope_llm_call_seconds", "LLM call latency.", ("func", "model"), buckets=LLM_BUCKETS)
+LLM_ERRORS = Counter(
+    "neurascope_llm_errors_total", "Failed LLM calls.", ("func", "model"))
+LLM_REJECTED = Counter(
+    "neurascope_llm_rejected_total", "LLM calls rejected because the concurrency limit was full.", ("func",))
+LLM_TOKENS = Counter(
+    "neurascope_llm_tokens_total", "LLM tokens by direction.", ("func", "kind"))
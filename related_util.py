@@ -0,0 +1,118 @@
+from __future__ import annotations
+import os, re, zlib, threading, unicodedata
+import numpy as np
+
+# ハッシュ化 n-gram ベクトルによる「関連論文」索引。
+#   <base>.f32 : float32 行列 (n, DIM) を生のまま追記、np.memmap で読む
+#   <base>.ids : 各行に対応する papers.id (int64, 昇順)
+DIM = int(os.getenv("RELATED_DIM", "256"))
+
+_WORD = re.compile(r"[a-z0-9]+")
+_NON_ASCII = re.compile(r"[^\x00-\x7f]+")
+_STOP = frozenset(
+    "a an and are as at be by for from has have in is it its of on or that the this to we with".split()
+)
+
+def _features(text: str) -> list[str]:
+    """英語は単語 unigram/bigram、日本語などは文字 bigram を特徴量にする"""
+    text = unicodedata.normalize("NFKC", text).lower()
+    words = [w for w in _WORD.findall(text) if w not in _STOP]
+    feats = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+    for chunk in _NON_ASCII.findall(text):
+        feats += [chunk[i : i + 2] for i in range(len(chunk) - 1)]
+    return feats
+
+def embed(text: str) -> np.ndarray:
+    """符号付き feature hashing で DIM 次元に落とし L2 正規化したベクトル"""
+    v = np.zeros(DIM, dtype=np.float32)
+    for f in _features(text):
+        h = zlib.crc32(f.encode())
+        v[h % DIM] += 1.0 if h & 0x80000000 else -1.0
+    n = np.linalg.norm(v)
+    return v / n if n else v
+
+# ───────────────────────── 索引ファイル
+_lock = threading.RLock()     # append は保持したまま _load を呼ぶ
+_cache: dict[str, tuple[tuple[int, int], np.ndarray, np.ndarray]] = {}
+
+def _load(base: str) -> tuple[np.ndarray, np.ndarray]:
+    """(ids, 行列) を返す。どちらかのファイルの大きさが変わったときだけ読み直す"""
+    try:
+        sizes = (os.path.getsize(base + ".f32"), os.path.getsize(base + ".ids"))
+    except OSError:
+        return np.empty(0, np.int64), np.empty((0, DIM), np.float32)
+    hit = _cache.get(base)
+    if hit and hit[0] == sizes:
+        return hit[1], hit[2]
+    with _lock:
+        try:
+            ids = np.fromfile(base + ".ids", dtype=np.int64)
+        except OSError:
+            return np.empty(0, np.int64), np.empty((0, DIM), np.float32)
+        n = min(sizes[0] // (4 * DIM), len(ids))
+        mat = np.memmap(base + ".f32", dtype=np.float32, mode="r", shape=(n, DIM)) if n else np.empty((0, DIM), np.float32)
+        _cache[base] = (sizes, ids[:n], mat)
+    return ids[:n], mat
+
+def append(base: str, rows: list[tuple[int, str]]):
+    """(paper_id, テキスト) を id 昇順で索引の末尾に追加する"""
+    if not rows:
+        return
+    rows = sorted(rows)
+    mat = np.stack([embed(t) for _, t in rows]).astype(np.float32)
+    with _lock:
+        ids, _ = _load(base)
+        n = len(ids)
+        # 前回の書き込みが途中で終わっていたら行数を揃えてから追記
+        with open(base + ".f32", "ab") as f:
+            f.truncate(n * 4 * DIM)
+            mat.tofile(f)
+        with open(base + ".ids", "ab") as f:
+            f.truncate(n * 8)
+            np.asarray([i for i, _ in rows], dtype=np.int64).tofile(f)
+        _cache.pop(base, None)
+
+def sync(base: str, conn) -> int:
+    """索引にまだ無い (id が末尾より大きい) 論文を追加し、追加件数を返す。
+
+    索引は追記のみで後から書き換えないので、解析 (analysis_ja) が入る前の行は載せない。
+    エンリッチ待ち (pending / running) の最小 id の手前までを追加し、残りは次回に回す。
+    """
+    ids, _ = _load(base)
+    last = int(ids[-1]) if len(ids) else 0
+    rows = [
+        (r[0], f"{r[1] or ''}\n{r[2] or ''}")
+        for r in conn.execute(
+            """SELECT id, abstract_en, analysis_ja FROM papers
+                WHERE id>:last AND id < COALESCE(
+                        (SELECT MIN(id) FROM papers
+                          WHERE id>:last AND enrich_status IN ('pending','running')), 1 << 62)
+             ORDER BY id""",
+            {"last": last},
+        )
+    ]
+    append(base, rows)
+    return len(rows)
+
+def rebuild(base: str, conn) -> int:
+    with _lock:
+        for ext in (".f32", ".ids"):
+            if os.path.exists(base + ext):
+                os.remove(base + ext)
+        _cache.pop(base, None)
+    return sync(base, conn)
+
+def related(base: str, paper_id: int, k: int = 5) -> list[tuple[int, float]]:
+    """paper_id に近い論文を (id, cosine 類似度) で k 件返す"""
+    ids, mat = _load(base)
+    pos = int(np.searchsorted(ids, paper_id))
+    if pos >= len(ids) or ids[pos] != paper_id:
+        return []
+    scores = mat @ mat[pos]          # 全件との類似度を 1 回の行列積で求める
+    scores[pos] = -np.inf
+    k = min(k, len(ids) - 1)
+    if k <= 0:
+        return []
+    top = np.argpartition(-scores, k - 1)[:k]
+    top = top[np.argsort(-scores[top])]
+    return [(int(ids[i]), float(scores[i])) for i in top]
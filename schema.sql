@@ -13,11 +13,19 @@ CREATE TABLE IF NOT EXISTS papers (
     comment         TEXT,
     published_at    DATETIME,
     analysis_ja     TEXT,
+    analysis_html   TEXT,          -- analysis_ja を描画した HTML
+    html_ver        TEXT,          -- 描画時の markdown / 拡張のバージョン
     tweet_ja        TEXT,
     pdf_url         TEXT,
     favorite        INTEGER DEFAULT 0,
     created_at      DATETIME DEFAULT CURRENT_TIMESTAMP,
-    translated_at   DATETIME
+    translated_at   DATETIME,
+    enrich_status   TEXT DEFAULT 'done',   -- pending | running | done | failed
+    enrich_attempts INTEGER DEFAULT 0,
+    enrich_error    TEXT,
+    lease_until     TEXT,                  -- running 中のリース期限 (UTC ISO)
+    created_ts      INTEGER GENERATED ALWAYS AS (unixepoch(created_at)) VIRTUAL,          -- 並べ替え用
+    created_day     INTEGER GENERATED ALWAYS AS (unixepoch(created_at) / 86400) VIRTUAL   -- UTC の日番号
 );
 
 -- ────────── 外部フィード
@@ -32,7 +40,13 @@ CREATE TABLE IF NOT EXISTS articles (
     source_id   TEXT,
     category    TEXT,          -- paper | news | blog
     favorite    INTEGER DEFAULT 0,
-    created_at  DATETIME DEFAULT CURRENT_TIMESTAMP
+    created_at  DATETIME DEFAULT CURRENT_TIMESTAMP,
+    enrich_status   TEXT DEFAULT 'done',
+    enrich_attempts INTEGER DEFAULT 0,
+    enrich_error    TEXT,
+    lease_until     TEXT,
+    created_ts      INTEGER GENERATED ALWAYS AS (unixepoch(created_at)) VIRTUAL,
+    created_day     INTEGER GENERATED ALWAYS AS (unixepoch(created_at) / 86400) VIRTUAL
 );
 
 -- ────────── Q&A（論文詳細ページ用）
@@ -41,6 +55,8 @@ CREATE TABLE IF NOT EXISTS qa (
     paper_id   INTEGER NOT NULL REFERENCES papers(id) ON DELETE CASCADE,
     question   TEXT NOT NULL,
     answer_md  TEXT NOT NULL,
+    answer_html TEXT,
+    html_ver   TEXT,
     created_at DATETIME DEFAULT CURRENT_TIMESTAMP
 );
 
@@ -50,9 +66,127 @@ CREATE TABLE IF NOT EXISTS article_qa (
     article_id  INTEGER NOT NULL REFERENCES articles(id) ON DELETE CASCADE,
     question    TEXT NOT NULL,
     answer_md   TEXT NOT NULL,
+    answer_html TEXT,
+    html_ver    TEXT,
     created_at  DATETIME DEFAULT CURRENT_TIMESTAMP
 );
 
-CREATE INDEX IF NOT EXISTS idx_papers_fav   ON papers(favorite);
-CREATE INDEX IF NOT EXISTS idx_articles_cat ON articles(category);
-CREATE INDEX IF NOT EXISTS idx_articles_fav ON articles(favorite);
+-- ────────── 翻訳キャッシュ（key = sha256(model, target_lang, 原文)）
+CREATE TABLE IF NOT EXISTS translation_cache (
+    key         TEXT PRIMARY KEY,
+    target_lang TEXT NOT NULL,
+    model       TEXT NOT NULL,
+    translated  TEXT NOT NULL,
+    created_at  DATETIME DEFAULT CURRENT_TIMESTAMP,
+    used_at     DATETIME DEFAULT CURRENT_TIMESTAMP
+);
+
+-- ────────── LLM 呼び出しごとのトークン数とレイテンシ（llm_util が記録）
+CREATE TABLE IF NOT EXISTS llm_calls (
+    id                INTEGER PRIMARY KEY AUTOINCREMENT,
+    func              TEXT NOT NULL,
+    model             TEXT NOT NULL,
+    prompt_tokens     INTEGER,
+    completion_tokens INTEGER,
+    latency_ms        INTEGER,
+    ok                INTEGER NOT NULL,
+    created_at        DATETIME DEFAULT CURRENT_TIMESTAMP
+);
+
+-- ────────── 取り込み・エンリッチの直近実行結果（/metrics が読む）
+CREATE TABLE IF NOT EXISTS ingest_runs (
+    job         TEXT NOT NULL,          -- arxiv / feeds / enrich
+    source      TEXT NOT NULL,          -- クエリ・source_id・テーブル名 (_total は全体)
+    items       INTEGER,
+    seconds     REAL,
+    ok          INTEGER NOT NULL,
+    finished_at INTEGER,                -- unix time
+    PRIMARY KEY (job, source)
+);
+
+-- ────────── arXiv 取り込みのウォーターマーク（クエリごとの最新 published）
+CREATE TABLE IF NOT EXISTS ingest_state (
+    query          TEXT PRIMARY KEY,
+    last_published TEXT,
+    updated_at     DATETIME
+);
+
+-- ────────── フィードごとの条件付き GET 用バリデータと適応ポーリングの状態
+CREATE TABLE IF NOT EXISTS feed_state (
+    source_id     TEXT PRIMARY KEY,
+    etag          TEXT,
+    last_modified TEXT,
+    checked_at    DATETIME,
+    poll_interval REAL,                 -- 適応ポーリングの現在の間隔 (秒)
+    last_poll_at  INTEGER,              -- unix time
+    next_poll_at  INTEGER,              -- unix time
+    failures      INTEGER DEFAULT 0     -- 連続エラー回数
+);
+
+-- ────────── 全文検索（FTS5 trigram: 日本語も分かち書き不要で部分一致できる）
+-- 本文列は archive_util で圧縮 (BLOB) されることがあるので、content は unz() で展開したビューにする。
+-- unz() はアプリが接続ごとに登録する関数なので、ビューの読み出し (snippet() を含む検索) はアプリ経由で行う。
+-- 書き込み側のトリガーは unz() を使わず、sqlite3 CLI などからでも papers / articles を更新できる:
+--   - 本文がすべて TEXT の行だけ索引を更新する
+--   - 圧縮・展開 (maintenance) は本文の内容を変えないので索引はそのまま
+--   - 圧縮済みの行の本文を外部から書き換えた場合は、maintenance --rebuild-fts で索引に反映される
+CREATE VIEW IF NOT EXISTS papers_text AS
+    SELECT id, title_en, title_ja, unz(abstract_en) AS abstract_en, unz(abstract_ja) AS abstract_ja,
+           unz(analysis_ja) AS analysis_ja
+      FROM papers;
+CREATE VIEW IF NOT EXISTS articles_text AS
+    SELECT id, title_en, title_ja, unz(summary_en) AS summary_en, unz(summary_ja) AS summary_ja
+      FROM articles;
+
+CREATE VIRTUAL TABLE IF NOT EXISTS papers_fts USING fts5(
+    title_en, title_ja, abstract_en, abstract_ja, analysis_ja,
+    content='papers_text', content_rowid='id', tokenize='trigram'
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS articles_fts USING fts5(
+    title_en, title_ja, summary_en, summary_ja,
+    content='articles_text', content_rowid='id', tokenize='trigram'
+);
+
+CREATE TRIGGER IF NOT EXISTS papers_fts_ai AFTER INSERT ON papers
+WHEN 'blob' NOT IN (typeof(new.abstract_en), typeof(new.abstract_ja), typeof(new.analysis_ja)) BEGIN
+    INSERT INTO papers_fts(rowid, title_en, title_ja, abstract_en, abstract_ja, analysis_ja)
+    VALUES (new.id, new.title_en, new.title_ja, new.abstract_en, new.abstract_ja, new.analysis_ja);
+END;
+CREATE TRIGGER IF NOT EXISTS papers_fts_ad AFTER DELETE ON papers
+WHEN 'blob' NOT IN (typeof(old.abstract_en), typeof(old.abstract_ja), typeof(old.analysis_ja)) BEGIN
+    INSERT INTO papers_fts(papers_fts, rowid, title_en, title_ja, abstract_en, abstract_ja, analysis_ja)
+    VALUES ('delete', old.id, old.title_en, old.title_ja, old.abstract_en, old.abstract_ja, old.analysis_ja);
+END;
+CREATE TRIGGER IF NOT EXISTS papers_fts_au
+AFTER UPDATE OF title_en, title_ja, abstract_en, abstract_ja, analysis_ja ON papers
+WHEN 'blob' NOT IN (typeof(old.abstract_en), typeof(old.abstract_ja), typeof(old.analysis_ja),
+                    typeof(new.abstract_en), typeof(new.abstract_ja), typeof(new.analysis_ja)) BEGIN
+    INSERT INTO papers_fts(papers_fts, rowid, title_en, title_ja, abstract_en, abstract_ja, analysis_ja)
+    VALUES ('delete', old.id, old.title_en, old.title_ja, old.abstract_en, old.abstract_ja, old.analysis_ja);
+    INSERT INTO papers_fts(rowid, title_en, title_ja, abstract_en, abstract_ja, analysis_ja)
+    VALUES (new.id, new.title_en, new.title_ja, new.abstract_en, new.abstract_ja, new.analysis_ja);
+END;
+
+CREATE TRIGGER IF NOT EXISTS articles_fts_ai AFTER INSERT ON articles
+WHEN 'blob' NOT IN (typeof(new.summary_en), typeof(new.summary_ja)) BEGIN
+    INSERT INTO articles_fts(rowid, title_en, title_ja, summary_en, summary_ja)
+    VALUES (new.id, new.title_en, new.title_ja, new.summary_en, new.summary_ja);
+END;
+CREATE TRIGGER IF NOT EXISTS articles_fts_ad AFTER DELETE ON articles
+WHEN 'blob' NOT IN (typeof(old.summary_en), typeof(old.summary_ja)) BEGIN
+    INSERT INTO articles_fts(articles_fts, rowid, title_en, title_ja, summary_en, summary_ja)
+    VALUES ('delete', old.id, old.title_en, old.title_ja, old.summary_en, old.summary_ja);
+END;
+CREATE TRIGGER IF NOT EXISTS articles_fts_au
+AFTER UPDATE OF title_en, title_ja, summary_en, summary_ja ON articles
+WHEN 'blob' NOT IN (typeof(old.summary_en), typeof(old.summary_ja),
+                    typeof(new.summary_en), typeof(new.summary_ja)) BEGIN
+    INSERT INTO articles_fts(articles_fts, rowid, title_en, title_ja, summary_en, summary_ja)
+    VALUES ('delete', old.id, old.title_en, old.title_ja, old.summary_en, old.summary_ja);
+    INSERT INTO articles_fts(rowid, title_en, title_ja, summary_en, summary_ja)
+    VALUES (new.id, new.title_en, new.title_ja, new.summary_en, new.summary_ja);
+END;
+
+CREATE INDEX IF NOT EXISTS idx_tcache_used  ON translation_cache(used_at);
+CREATE INDEX IF NOT EXISTS idx_llm_calls_created ON llm_calls(created_at);
+-- created_ts / favorite / category の複合索引は app.py の POST_MIGRATION で張る
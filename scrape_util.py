@@ -0,0 +1,77 @@
+from __future__ import annotations
+import re
+from typing import TYPE_CHECKING
+from urllib.parse import urljoin
+
+if TYPE_CHECKING:   # bs4 は使う関数の中で import する
+    from bs4 import SoupStrainer
+
+# HTML ソースの共通スクレイパー。feeds.SCRAPERS のセレクタ定義 (データ) だけで動く。
+#   item    : 1 件分の要素 (tag.class をカンマ区切り)。ここから SoupStrainer を作り、
+#             ページ全体ではなくこの要素の部分木だけをパースする
+#   title   : タイトル要素のセレクタ (リストなら先に見つかったもの)
+#   link    : href を持つ要素 (省略時は title と同じ要素)
+#   summary : 概要 (任意)
+#   base    : 相対リンクを解決する URL
+#   sep     : get_text の区切り (GitHub の "owner / repo" など)
+try:
+    import lxml  # noqa: F401
+    PARSER = "lxml"
+except ImportError:
+    PARSER = "html.parser"
+
+_SIMPLE = re.compile(r"^([a-z0-9]+)?(?:\.([\w-]+))?$", re.I)
+_strainers: dict[str, SoupStrainer | None] = {}
+
+def _strainer(item: str) -> SoupStrainer | None:
+    """'article.Box-row, div.post-block' のような単純セレクタから SoupStrainer を作る。
+
+    単純セレクタに落とせないものは None (ページ全体をパース) にする。
+    """
+    if item in _strainers:
+        return _strainers[item]
+    from bs4 import SoupStrainer
+
+    names, classes = set(), set()
+    for part in item.split(","):
+        m = _SIMPLE.match(part.strip())
+        if not m or not m.group(1):
+            _strainers[item] = None
+            return None
+        names.add(m.group(1).lower())
+        if m.group(2):
+            classes.add(m.group(2))
+    # tag とクラスの組み合わせは後の select で正確に絞る
+    strainer = SoupStrainer(list(names), class_=list(classes) if classes else None)
+    _strainers[item] = strainer
+    return strainer
+
+def _first(node, selectors):
+    for sel in [selectors] if isinstance(selectors, str) else selectors:
+        found = node.select_one(sel)
+        if found is not None:
+            return found
+    return None
+
+def _text(node, sep: str = "") -> str:
+    return " ".join(node.get_text(sep, strip=True).split()) if node is not None else ""
+
+def scrape(spec: dict, html: str) -> list[dict]:
+    """spec に従って {title, link, summary} のリストを返す。タイトルかリンクが無い要素は捨てる"""
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(html, PARSER, parse_only=_strainer(spec["item"]))
+    out = []
+    for node in soup.select(spec["item"]):
+        title = _first(node, spec["title"])
+        link = _first(node, spec.get("link", spec["title"]))
+        href = link.get("href") if link is not None else None
+        if title is None or not href:
+            continue
+        summary = _first(node, spec["summary"]) if spec.get("summary") else None
+        out.append({
+            "title": _text(title, spec.get("sep", "")),
+            "link": urljoin(spec["base"], href) if spec.get("base") else href,
+            "summary": _text(summary),
+        })
+    return out
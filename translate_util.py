@@ -1,18 +1,177 @@
 from __future__ import annotations
-import os, backoff, openai
+import os, json, sqlite3, hashlib, threading
+import llm_util
 
-openai.api_key = os.getenv("OPENAI_API_KEY")
 MODEL = os.getenv("OPENAI_MODEL_NAME", "gpt-4o-mini")
+BATCH_TOKENS = int(os.getenv("TRANSLATE_BATCH_TOKENS", "2000"))   # 1 リクエストに詰める入力トークン目安
 
-@backoff.on_exception(backoff.expo, openai.OpenAIError, max_tries=5, jitter=None)
-def _chat(msgs):  # type: ignore[valid-type]
-    return openai.chat.completions.create(model=MODEL, messages=msgs, temperature=0.2
-    ).choices[0].message.content.strip()
+class TranslationError(RuntimeError):
+    """strict=True の翻訳が失敗した (原文で代用しない)"""
 
-def translate_text_openai(text: str, target_lang: str = "ja") -> str:
+@llm_util.retry(max_tries=5, jitter=None)
+def _chat(func, msgs, **kw):
+    # 翻訳は入力を切り詰めると訳文が欠けるので budget なし (バッチ側で BATCH_TOKENS に収める)
+    return llm_util.chat(func, msgs, model=MODEL, budget=None, temperature=0.2, **kw)
+
+# ───────────────────────── 翻訳キャッシュ (SQLite)
+CACHE_DB       = os.getenv("NEURASCOPE_DB", "neurascope.db")
+CACHE_MAX_ROWS = int(os.getenv("TRANSLATE_CACHE_MAX_ROWS", "200000"))
+CACHE_TTL_DAYS = int(os.getenv("TRANSLATE_CACHE_TTL_DAYS", "365"))
+CACHE_STATS    = {"hit": 0, "miss": 0}
+
+_stats_lock = threading.Lock()
+_local = threading.local()
+
+def _cache_db() -> sqlite3.Connection:
+    """スレッドごとに使い回すキャッシュ用接続 (close しない)。テーブルは schema.sql で作る (app.init_db)"""
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = _local.conn = sqlite3.connect(CACHE_DB, timeout=30, check_same_thread=False)
+        conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+def _cache_key(text: str, target_lang: str) -> str:
+    return hashlib.sha256(f"{MODEL}\0{target_lang}\0{text}".encode()).hexdigest()
+
+def _count(hit: int, miss: int):
+    with _stats_lock:
+        CACHE_STATS["hit"] += hit
+        CACHE_STATS["miss"] += miss
+
+def cache_get_many(texts: list[str], target_lang: str) -> dict[str, str]:
+    """キャッシュ済みの翻訳を {原文: 訳文} で返す。DB エラー時は全件ミス扱い。"""
+    keys = {_cache_key(t, target_lang): t for t in texts}
+    found: dict[str, str] = {}
+    try:
+        with _cache_db() as conn:
+            ks = list(keys)
+            for i in range(0, len(ks), 500):
+                chunk = ks[i:i + 500]
+                marks = ",".join("?" * len(chunk))
+                for k, v in conn.execute(
+                    f"SELECT key, translated FROM translation_cache WHERE key IN ({marks})", chunk
+                ):
+                    found[keys[k]] = v
+                conn.execute(
+                    f"UPDATE translation_cache SET used_at=CURRENT_TIMESTAMP WHERE key IN ({marks})", chunk
+                )
+            conn.commit()
+    except sqlite3.Error as exc:
+        print("[translate_util] cache read failed:", exc)
+    _count(len(found), len(keys) - len(found))
+    return found
+
+def cache_put_many(pairs: dict[str, str], target_lang: str):
+    try:
+        with _cache_db() as conn:
+            conn.executemany(
+                """INSERT OR REPLACE INTO translation_cache (key, target_lang, model, translated)
+                   VALUES (?,?,?,?)""",
+                [(_cache_key(t, target_lang), target_lang, MODEL, v) for t, v in pairs.items()],
+            )
+            conn.commit()
+    except sqlite3.Error as exc:
+        print("[translate_util] cache write failed:", exc)
+
+def prune_cache(max_rows: int = CACHE_MAX_ROWS, max_age_days: int = CACHE_TTL_DAYS) -> int:
+    """古いエントリと、件数上限を超えた最終利用の古いエントリを削除する"""
+    with _cache_db() as conn:
+        n = conn.execute(
+            "DELETE FROM translation_cache WHERE created_at < datetime('now', ?)",
+            (f"-{max_age_days} days",),
+        ).rowcount
+        n += conn.execute(
+            """DELETE FROM translation_cache WHERE key IN (
+                 SELECT key FROM translation_cache ORDER BY used_at DESC LIMIT -1 OFFSET ?)""",
+            (max_rows,),
+        ).rowcount
+        conn.commit()
+    return n
+
+# ───────────────────────── 単体翻訳
+def _translate_uncached(text: str, target_lang: str, strict: bool = False) -> str:
     sys = ("You are a professional translator. "
            f"Translate everything into {target_lang}. Return only the translation.")
     try:
-        return _chat([{"role":"system","content":sys},{"role":"user","content":text}])
+        out = _chat("translate", [{"role":"system","content":sys},{"role":"user","content":text}])
     except Exception as exc:  # noqa: BLE001
+        if strict:
+            raise TranslationError(f"translate failed: {exc}") from exc
         print("[translate_util] failed:", exc); return text
+    cache_put_many({text: out}, target_lang)
+    return out
+
+def translate_text_openai(text: str, target_lang: str = "ja", strict: bool = False) -> str:
+    """失敗時は原文を返す。strict=True なら TranslationError を送出する (エンリッチキュー用)"""
+    hit = cache_get_many([text], target_lang)
+    if text in hit:
+        return hit[text]
+    return _translate_uncached(text, target_lang, strict)
+
+# ───────────────────────── バッチ翻訳
+def _batches(items: list[tuple[int, str]], budget: int):
+    """(key, text) をトークン予算ごとに分割する"""
+    batch, size = [], 0
+    for key, text in items:
+        n = llm_util.count_tokens(text, MODEL)
+        if batch and size + n > budget:
+            yield batch
+            batch, size = [], 0
+        batch.append((key, text)); size += n
+    if batch:
+        yield batch
+
+def _translate_batch(batch: list[tuple[int, str]], target_lang: str) -> dict[int, str]:
+    sys = ("You are a professional translator. "
+           f"Translate every value of the given JSON object into {target_lang}. "
+           "Return a JSON object with exactly the same keys whose values are only the translations.")
+    payload = json.dumps({str(k): t for k, t in batch}, ensure_ascii=False)
+    data = json.loads(_chat("translate_batch",
+                            [{"role":"system","content":sys},{"role":"user","content":payload}],
+                            response_format={"type": "json_object"}))
+    return {int(k): v.strip() for k, v in data.items()
+            if str(k).isdigit() and isinstance(v, str) and v.strip()}
+
+def translate_many(texts: list[str], target_lang: str = "ja", strict: bool = False,
+                   errors: dict[int, Exception] | None = None) -> list[str]:
+    """複数テキストを JSON にまとめて翻訳する。結果は texts と同じ順序で返す。
+
+    空文字はそのまま返し、同一テキストやキャッシュ済みのテキストは送らない。応答に
+    含まれなかった項目だけを再バッチし、それでも失敗したものは 1 件ずつ翻訳する。
+    最後まで失敗した項目は原文のまま返すが、strict=True なら TranslationError を送出する
+    (訳せた分はキャッシュに残るので、呼び出し側は後で丸ごとやり直せばよい)。
+    errors を渡すと送出せず、失敗した項目を {texts の添字: 例外} で errors に書き込む。
+    """
+    out = list(texts)
+    uniq: dict[str, list[int]] = {}
+    for i, t in enumerate(texts):
+        if t and t.strip():
+            uniq.setdefault(t, []).append(i)
+    cached = cache_get_many(list(uniq), target_lang)
+    pending = [(k, t) for k, t in enumerate(uniq) if t not in cached]
+    done: dict[int, str] = {}
+    for _ in range(2):
+        failed = []
+        for batch in _batches(pending, BATCH_TOKENS):
+            try:
+                got = _translate_batch(batch, target_lang)
+            except Exception as exc:  # noqa: BLE001
+                print("[translate_util] batch failed:", exc); got = {}
+            done.update(got)
+            cache_put_many({t: got[k] for k, t in batch if k in got}, target_lang)
+            failed += [(k, t) for k, t in batch if k not in got]
+        pending = failed
+        if not pending:
+            break
+    for k, t in pending:
+        try:
+            done[k] = _translate_uncached(t, target_lang, strict or errors is not None)
+        except TranslationError as exc:
+            if errors is None:
+                raise
+            done[k] = t
+            errors.update((i, exc) for i in uniq[t])
+    for k, t in enumerate(uniq):
+        for i in uniq[t]:
+            out[i] = cached[t] if t in cached else done[k]
+    return out